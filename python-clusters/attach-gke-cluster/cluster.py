@@ -4,11 +4,11 @@ from dataiku.cluster import Cluster
 
 from dku_google.auth import get_credentials_from_json_or_file
 from dku_google.clusters import Clusters
-from dku_google.gcloud import create_kube_config_file
-from dku_kube.kubeconfig import merge_or_write_config
+from dku_kube.kubeconfig import merge_or_write_config, write_kube_config_from_cluster_info
 from dku_kube.role import create_admin_binding
 from dku_utils.cluster import make_overrides, get_cluster_from_connection_info
 from dku_utils.access import _has_not_blank_property
+from dku_utils.concurrency import Step, run_steps, CLUSTER_INFO_TIMEOUT, KUBE_SETUP_TIMEOUT
 
 class MyCluster(Cluster):
     def __init__(self, cluster_id, cluster_name, config, plugin_config, global_settings):
@@ -26,21 +26,26 @@ class MyCluster(Cluster):
         clusters = get_cluster_from_connection_info(self.config['connectionInfo'], self.plugin_config['connectionInfo'])
                 
         is_regional = self.config.get('isRegional', False)
-        cluster = clusters.get_cluster(self.config.get('clusterId', self.cluster_name), 'regional' if is_regional else 'zonal')
-        cluster_info = cluster.get_info()
-
-        # delegate the creation of the kube config file to gcloud to use the client go auth plugin
         kube_config_path = os.path.join(os.getcwd(), 'kube_config')
-        region_or_zone = clusters.region if is_regional else clusters.zone
-        is_dns_endpoint = self.config.get('isDnsEndpoint', False)
-        create_kube_config_file(clusters.project_id, cluster.name, is_regional, region_or_zone, kube_config_path, is_dns_endpoint)
-                
-        # add the admin role so that we can do the managed kubernetes stuff for spark
-        create_admin_binding(self.config.get("userName", None), kube_config_path)
-        
-        # collect and prepare the overrides so that DSS can know where and how to use the cluster
-        overrides = make_overrides(kube_config_path)
-        return [overrides, {'kube_config_path':kube_config_path, 'cluster':cluster_info}]
+        def get_cluster_info(results):
+            cluster = clusters.get_cluster(self.config.get('clusterId', self.cluster_name), 'regional' if is_regional else 'zonal')
+            return cluster.get_info()
+        def write_kube_config(results):
+            # authenticating with the client go auth plugin
+            is_dns_endpoint = self.config.get('isDnsEndpoint', False)
+            write_kube_config_from_cluster_info(clusters.project_id, results['clusterInfo'], kube_config_path, is_dns_endpoint)
+        def add_admin_binding(results):
+            # add the admin role so that we can do the managed kubernetes stuff for spark
+            create_admin_binding(self.config.get("userName", None), kube_config_path)
+        def get_overrides(results):
+            # collect and prepare the overrides so that DSS can know where and how to use the cluster
+            return make_overrides(kube_config_path)
+
+        results, step_timings = run_steps([Step('clusterInfo', get_cluster_info, timeout=CLUSTER_INFO_TIMEOUT),
+                                           Step('kubeConfig', write_kube_config, ['clusterInfo'], timeout=KUBE_SETUP_TIMEOUT),
+                                           Step('adminBinding', add_admin_binding, ['kubeConfig'], timeout=KUBE_SETUP_TIMEOUT),
+                                           Step('overrides', get_overrides, ['kubeConfig'], timeout=KUBE_SETUP_TIMEOUT)])
+        return [results['overrides'], {'kube_config_path':kube_config_path, 'cluster':results['clusterInfo'], 'startStepTimings':step_timings}]
 
     def stop(self, data):
         pass
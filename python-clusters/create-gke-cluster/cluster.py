@@ -5,12 +5,14 @@ from dataiku.cluster import Cluster
 
 from dku_google.auth import get_credentials_from_json_or_file
 from dku_google.clusters import Clusters
-from dku_google.gcloud import create_kube_config_file
-from dku_kube.kubeconfig import merge_or_write_config
+from dku_google.gcloud import get_instance_network, get_instance_service_account
+from dku_google.operations import CLUSTER_OPERATION_TIMEOUT
+from dku_kube.kubeconfig import merge_or_write_config, write_kube_config_from_cluster_info
 from dku_kube.role import create_admin_binding
-from dku_kube.nvidia_utils import create_installer_daemonset_if_needed
+from dku_kube.nvidia_utils import create_installer_daemonset_if_needed, get_gke_gpu_driver_version, wait_for_gpu_nodes_ready, get_expected_gpu_nodes, GPU_NODES_READY_TIMEOUT
 from dku_utils.cluster import make_overrides, get_cluster_from_connection_info
 from dku_utils.access import _has_not_blank_property
+from dku_utils.concurrency import Step, StepException, run_steps, HOST_LOOKUP_TIMEOUT, CLUSTER_INFO_TIMEOUT, KUBE_SETUP_TIMEOUT
 
 class MyCluster(Cluster):
     def __init__(self, cluster_id, cluster_name, config, plugin_config, global_settings):
@@ -28,6 +30,8 @@ class MyCluster(Cluster):
         
         is_autopilot = self.config.get("isAutopilot", False)
         is_regional = is_autopilot or self.config.get('isRegional', False)
+
+        self._prewarm_host_lookups(clusters, is_autopilot)
         
         cluster_builder = clusters.new_cluster_builder()
         
@@ -56,6 +60,7 @@ class MyCluster(Cluster):
         cluster_builder.with_labels(self.config.get("clusterLabels", {}))
         cluster_builder.with_partner_google_urn(MyCluster.resolve_partner_google_urn())
         has_gpu = False
+        needs_driver_installer = False
 
         if not is_autopilot:
             cluster_builder.with_http_load_balancing(self.config.get("httpLoadBalancing", False))
@@ -72,7 +77,8 @@ class MyCluster(Cluster):
                 node_pool_builder.with_service_account(node_pool.get('serviceAccountType', None),
                                                        node_pool.get('serviceAccount', None))
                 node_pool_builder.with_auto_scaling(node_pool.get('numNodesAutoscaling', False), node_pool.get('minNumNodes', 2), node_pool.get('maxNumNodes', 5))
-                node_pool_builder.with_gpu(node_pool.get('withGpu', False), node_pool.get('gpuType', None), node_pool.get('gpuCount', 1))
+                node_pool_builder.with_gpu(node_pool.get('withGpu', False), node_pool.get('gpuType', None), node_pool.get('gpuCount', 1),
+                                           get_gke_gpu_driver_version(node_pool))
                 node_pool_builder.with_spot_vms(node_pool.get('useSpotVms', False))
                 node_pool_builder.with_nodepool_labels(node_pool.get('nodepoolLabels', {}))
                 node_pool_builder.with_nodepool_taints(node_pool.get('nodepoolTaints', []))
@@ -81,34 +87,70 @@ class MyCluster(Cluster):
                 node_pool_builder.build()
 
                 has_gpu |= node_pool.get('withGpu', False)
+                needs_driver_installer |= node_pool.get('withGpu', False) and get_gke_gpu_driver_version(node_pool) is None
         cluster_builder.with_settings_valve(self.config.get("creationSettingsValve", None))
         
         start_op = cluster_builder.build()
         
         # can take a few mins...
         logging.info("Waiting for cluster start")
-        start_op.wait_done()
+        start_op.wait_done(timeout=CLUSTER_OPERATION_TIMEOUT)
         logging.info("Cluster started")
         
-        # cluster is ready, fetch its info from GKE
-        cluster = clusters.get_cluster(self.cluster_name, 'regional' if is_regional else 'zonal')
-        cluster_info = cluster.get_info()
-
-        # delegate the creation of the kube config file to gcloud to use the client go auth plugin
+        # cluster is ready, fetch its info from GKE, write the kube config, then run the steps needing the
+        # kube config side by side
         kube_config_path = os.path.join(os.getcwd(), 'kube_config')
-        region_or_zone = clusters.region if is_regional else clusters.zone
-        create_kube_config_file(clusters.project_id, self.cluster_id, is_regional, region_or_zone, kube_config_path)
-        
-        # add the admin role so that we can do the managed kubernetes stuff for spark
-        create_admin_binding(self.config.get("userName", None), kube_config_path)
-        
-        # Launch NVIDIA driver installer daemonset (will only apply on tainted gpu nodes)
-        if not is_autopilot and has_gpu: # GPUs are not supported on autopilot (says the GKE doc)
-            create_installer_daemonset_if_needed(kube_config_path=kube_config_path)
-        
-        # collect and prepare the overrides so that DSS can know where and how to use the cluster
-        overrides = make_overrides(kube_config_path)
-        return [overrides, {'kube_config_path':kube_config_path, 'cluster':cluster_info}]
+        def get_cluster_info(results):
+            cluster = clusters.get_cluster(self.cluster_name, 'regional' if is_regional else 'zonal')
+            return cluster.get_info()
+        def write_kube_config(results):
+            # authenticating with the client go auth plugin
+            write_kube_config_from_cluster_info(clusters.project_id, results['clusterInfo'], kube_config_path)
+        def add_admin_binding(results):
+            # add the admin role so that we can do the managed kubernetes stuff for spark
+            create_admin_binding(self.config.get("userName", None), kube_config_path)
+        def install_gpu_drivers(results):
+            # Launch NVIDIA driver installer daemonset (will only apply on tainted gpu nodes)
+            create_installer_daemonset_if_needed(kube_config_path=kube_config_path, use_bundled_manifest=self.config.get('useBundledGpuDriverManifest', False))
+        def wait_gpu_nodes(results):
+            # so that the first GPU jobs don't land on nodes without drivers
+            expected_nodes = get_expected_gpu_nodes(results['clusterInfo'].get('nodePools', []))
+            return wait_for_gpu_nodes_ready(kube_config_path, expected_nodes)
+        def get_overrides(results):
+            # collect and prepare the overrides so that DSS can know where and how to use the cluster
+            return make_overrides(kube_config_path)
+
+        steps = [Step('clusterInfo', get_cluster_info, timeout=CLUSTER_INFO_TIMEOUT),
+                 Step('kubeConfig', write_kube_config, ['clusterInfo'], timeout=KUBE_SETUP_TIMEOUT),
+                 Step('adminBinding', add_admin_binding, ['kubeConfig'], timeout=KUBE_SETUP_TIMEOUT),
+                 Step('overrides', get_overrides, ['kubeConfig'], timeout=KUBE_SETUP_TIMEOUT)]
+        # GKE installs the drivers itself unless some pool relies on the daemonset
+        if not is_autopilot and needs_driver_installer: # GPUs are not supported on autopilot (says the GKE doc)
+            steps.append(Step('gpuDriverInstaller', install_gpu_drivers, ['kubeConfig'], timeout=KUBE_SETUP_TIMEOUT))
+        if not is_autopilot and has_gpu:
+            steps.append(Step('gpuNodesReady', wait_gpu_nodes, [step.name for step in steps if step.name in ['clusterInfo', 'kubeConfig', 'gpuDriverInstaller']],
+                              timeout=GPU_NODES_READY_TIMEOUT + 60))
+        results, step_timings = run_steps(steps)
+
+        return [results['overrides'], {'kube_config_path':kube_config_path, 'cluster':results['clusterInfo'], 'startTimings':start_op.get_timings(),
+                                       'gpuNodesReadiness':results.get('gpuNodesReady', None), 'startStepTimings':step_timings}]
+
+    def _prewarm_host_lookups(self, clusters, is_autopilot):
+        """
+        Look up the DSS host's network and service account in parallel, so that the (memoized) lookups
+        done while building the request are instantaneous. Failures are left for the builders to report.
+        """
+        steps = []
+        if self.config.get("inheritFromDSSHost", True):
+            steps.append(Step('hostNetwork', lambda results: get_instance_network(clusters.compute), timeout=HOST_LOOKUP_TIMEOUT))
+        if not is_autopilot and any([node_pool.get('serviceAccountType', None) == 'fromDSSHost' for node_pool in self.config.get('nodePools', [])]):
+            steps.append(Step('hostServiceAccount', lambda results: get_instance_service_account(), timeout=HOST_LOOKUP_TIMEOUT))
+        if len(steps) < 2:
+            return
+        try:
+            run_steps(steps)
+        except StepException as e:
+            logging.warning("Failed to look up the DSS host's settings ahead: %s" % str(e))
 
     def stop(self, data):
         clusters = get_cluster_from_connection_info(self.config['connectionInfo'], self.plugin_config['connectionInfo'])  
@@ -117,7 +159,7 @@ class MyCluster(Cluster):
         cluster = clusters.get_cluster(self.cluster_name, 'regional' if is_regional else 'zonal')
         stop_op = cluster.stop()    
         logging.info("Waiting for cluster stop")
-        stop_op.wait_done()
+        stop_op.wait_done(timeout=CLUSTER_OPERATION_TIMEOUT)
         logging.info("Cluster stopped")
 
     @staticmethod
@@ -1,16 +1,22 @@
-from googleapiclient import discovery
 from six import text_type
 from googleapiclient.errors import HttpError
 from dku_google.gcloud import get_sdk_root, get_access_token_and_expiry, get_instance_info
 from dku_google.gcloud import get_instance_network, get_instance_service_account
-from dku_utils.access import _has_not_blank_property, _is_none_or_blank, _default_if_blank, _merge_objects
+from dku_utils.access import _has_not_blank_property, _is_none_or_blank, _default_if_blank
+from dku_utils.settings_valve import compile_settings_valve
 
-import os, sys, json, re, random
+import os, sys, json, re, random, time, threading
 import logging
 
 from .operations import Operation
+from .discovery_documents import build_client
 
 GCE_METADATA_MTLS_MODE_ENV = "GCE_METADATA_MTLS_MODE"
+# max number of calls in one batch request of the Google APIs
+MAX_BATCH_SIZE = 1000
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+# socket timeout (in seconds) of the per-thread transports, so that a call can't block its thread forever
+HTTP_TIMEOUT = 20
 
 
 def _configure_google_auth_env():
@@ -34,6 +40,7 @@ class NodePoolBuilder(object):
         self.enable_gpu = False
         self.gpu_type = None
         self.gpu_count = None
+        self.gpu_driver_version = None
         self.use_spot_vms = False
         self.service_account = None
         self.nodepool_labels = {}
@@ -105,13 +112,19 @@ class NodePoolBuilder(object):
         return self
     
     def with_settings_valve(self, settings_valve):
-        self.settings_valve = _default_if_blank(settings_valve, None)
+        # parsed and checked right away, so that an invalid valve fails before anything is requested
+        self.settings_valve = compile_settings_valve(settings_valve)
         return self
 
-    def with_gpu(self, enable_gpu, gpu_type, gpu_count):
+    def with_gpu(self, enable_gpu, gpu_type, gpu_count, driver_version=None):
+        """
+        driver_version is the version of the NVIDIA drivers GKE installs at node boot (DEFAULT, LATEST, ...).
+        If None, GKE installs nothing and the drivers are left to the installer daemonset.
+        """
         self.enable_gpu = enable_gpu
         self.gpu_type = gpu_type
         self.gpu_count = gpu_count
+        self.gpu_driver_version = driver_version
         return self
 
     def with_spot_vms(self, use_spot_vms):
@@ -165,6 +178,8 @@ class NodePoolBuilder(object):
             logging.info("GPU option enabled.")
             node_pool['config']['accelerators'] = [{'acceleratorCount': self.gpu_count,
                                                     'acceleratorType': self.gpu_type}]
+            if self.gpu_driver_version is not None:
+                node_pool['config']['accelerators'][0]['gpuDriverInstallationConfig'] = {'gpuDriverVersion': self.gpu_driver_version}
         if self.use_spot_vms:
             node_pool['config']['spot'] = True
         if self.disk_size_gb is not None and self.disk_size_gb > 0:
@@ -189,9 +204,8 @@ class NodePoolBuilder(object):
         node_pool["config"]["resourceLabels"] = self.nodepool_gcp_labels
         node_pool["config"]["tags"] = self.nodepool_tags
             
-        if not _is_none_or_blank(self.settings_valve):
-            valve = json.loads(self.settings_valve)
-            node_pool = _merge_objects(node_pool, valve)
+        if self.settings_valve is not None:
+            node_pool = self.settings_valve.apply(node_pool)
 
         if isinstance(self.cluster_builder, ClusterBuilder):
             self.cluster_builder.with_node_pool(node_pool)
@@ -257,7 +271,7 @@ class ClusterBuilder(object):
         self.is_same_network_as_dss = is_same_network_as_dss
         if self.is_same_network_as_dss:
             logging.info("Cluster network/subnetwork is the SAME AS DSS HOST")
-            self.network, self.subnetwork = get_instance_network()
+            self.network, self.subnetwork = get_instance_network(self.clusters.compute)
         else:
             logging.info("Cluster network/subnetwork is set EXPLICITLY")
             self.network = _default_if_blank(network, None)
@@ -301,7 +315,8 @@ class ClusterBuilder(object):
         return self
 
     def with_settings_valve(self, settings_valve):
-        self.settings_valve = _default_if_blank(settings_valve, None)
+        # parsed and checked right away, so that an invalid valve fails before anything is requested
+        self.settings_valve = compile_settings_valve(settings_valve)
         return self
 
     def with_partner_google_urn(self, partner_google_urn):
@@ -392,9 +407,8 @@ class ClusterBuilder(object):
             # the cluster will be automatically enrolled in the most stable channel possible for the defined cluster version (Regular if the version is 'latest')
             create_cluster_request_body['cluster']['releaseChannel'] = {"channel": self.release_channel}
 
-        if not _is_none_or_blank(self.settings_valve):
-            valve = json.loads(self.settings_valve)
-            create_cluster_request_body["cluster"] = _merge_objects(create_cluster_request_body["cluster"], valve)
+        if self.settings_valve is not None:
+            create_cluster_request_body["cluster"] = self.settings_valve.apply(create_cluster_request_body["cluster"])
                 
         logging.info("Requesting cluster %s" % json.dumps(create_cluster_request_body, indent=2))
                 
@@ -418,9 +432,20 @@ class ClusterBuilder(object):
                 raise Exception("Failed to create cluster : %s" % str(e))
     
 class NodePool(object):
-    def __init__(self, name, cluster):
+    # how long (in seconds) a definition already fetched from GKE is reused by get_info()
+    INFO_MAX_AGE = 60
+
+    def __init__(self, name, cluster, info=None):
         self.name = name
         self.cluster = cluster
+        self._set_info(info)
+
+    def _set_info(self, info):
+        self.info = info
+        self.info_time = time.time() if info is not None else None
+
+    def invalidate(self):
+        self._set_info(None)
         
     def get_location_params(self):
         # the zonal and regional APIs don't have the same args, and notably the zonal API
@@ -433,29 +458,37 @@ class NodePool(object):
         else:
             return {'name':"%s/nodePools/%s" % (self.cluster.get_location(), self.name)}
         
-    def get_info(self):
+    def get_info(self, max_age=None, http=None):
+        """
+        Get the node pool definition. The one held from the node pools listing (or from a previous call)
+        is reused if it's less than max_age seconds old (INFO_MAX_AGE by default). Use max_age=0 to force a fetch.
+        Calls from worker threads must pass http=clusters.get_http().
+        """
+        if max_age is None:
+            max_age = NodePool.INFO_MAX_AGE
+        if self.info is not None and time.time() - self.info_time <= max_age:
+            return self.info
         request = self.cluster.get_node_pools_api().get(**self.get_location_params())
-        response = request.execute()
+        response = request.execute(http=http)
+        self._set_info(response)
         return response
     
-    def get_instance_groups_info(self):
-        node_pool_info = self.get_info()
-        instance_groups = []
-        for instance_group_url in node_pool_info.get("instanceGroupUrls", []):
-            # the zone should be fetched from the url, since regional clusters will have
-            # instance groups in several zones
-            m = re.match("^.*/([^/]+)/[^/]+/([^/]+)", instance_group_url)
-            instance_group_zone = m.group(1)
-            instance_group_name = m.group(2)
-            location_params = self.cluster.get_parent_location_params()
-            # the parameter is named 'project' and not 'projectId', hurray for consistency
-            clean_location_params = {'project':location_params.get('projectId', None)}
-            # put the right zone in (might not be the cluster's)
-            clean_location_params["zone"] = instance_group_zone
-            logging.info("get_instance_groups_api %s  %s" % (instance_group_name, str(clean_location_params)))
-            request = self.cluster.get_instance_groups_api().get(instanceGroup=instance_group_name, **clean_location_params)
-            instance_groups.append(request.execute())
-        return instance_groups
+    def _get_instance_group_request(self, instance_group_url):
+        # the zone should be fetched from the url, since regional clusters will have
+        # instance groups in several zones
+        m = re.match("^.*/([^/]+)/[^/]+/([^/]+)", instance_group_url)
+        instance_group_zone = m.group(1)
+        instance_group_name = m.group(2)
+        location_params = self.cluster.get_parent_location_params()
+        # the parameter is named 'project' and not 'projectId', hurray for consistency
+        clean_location_params = {'project':location_params.get('projectId', None)}
+        # put the right zone in (might not be the cluster's)
+        clean_location_params["zone"] = instance_group_zone
+        logging.info("get_instance_groups_api %s  %s" % (instance_group_name, str(clean_location_params)))
+        return self.cluster.get_instance_groups_api().get(instanceGroup=instance_group_name, **clean_location_params)
+
+    def get_instance_groups_info(self, http=None):
+        return self.cluster.get_instance_groups_info([self], http)[0]
         
     def resize(self, num_nodes):
         resize_cluster_request_body = {
@@ -463,6 +496,7 @@ class NodePool(object):
         }
 
         request = self.cluster.get_node_pools_api().setSize(body=resize_cluster_request_body, **self.get_location_params())
+        self.invalidate()
         try:
             response = request.execute()
             return Operation(response, self.cluster.get_operations_api(), self.cluster.get_parent_location_params())
@@ -471,6 +505,7 @@ class NodePool(object):
         
     def delete(self):
         request = self.cluster.get_node_pools_api().delete(**self.get_location_params())
+        self.invalidate()
         try:
             response = request.execute()
             return Operation(response, self.cluster.get_operations_api(), self.cluster.get_parent_location_params())
@@ -493,6 +528,7 @@ class NodePool(object):
         if 'name' in parent_location_params:
             parent_location_params = {'parent':parent_location_params['name']}
         request = self.cluster.get_node_pools_api().create(body=create_node_pool_request_body, **parent_location_params)
+        self.invalidate()
         
         try:
             response = request.execute()
@@ -544,6 +580,36 @@ class Cluster(object):
                     
     def get_instance_groups_api(self):
         return self.clusters.get_instance_groups_api()
+
+    def get_instance_groups_info(self, node_pools, http=None):
+        """
+        Fetch the instance groups of all the node pools in batched requests instead of one call per
+        instance group. Returns one list of instance groups per node pool, in the same order.
+        Calls from worker threads must pass http=clusters.get_http().
+        """
+        requests = []
+        for i in range(0, len(node_pools)):
+            for j, instance_group_url in enumerate(node_pools[i].get_info(http=http).get("instanceGroupUrls", [])):
+                requests.append(((i, j), node_pools[i]._get_instance_group_request(instance_group_url)))
+
+        responses = {}
+        errors = []
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            responses[request_id] = response
+        for start in range(0, len(requests), MAX_BATCH_SIZE):
+            batch = self.clusters.compute.new_batch_http_request()
+            for request_idx, request in requests[start:start + MAX_BATCH_SIZE]:
+                batch.add(request, callback=callback, request_id="%s-%s" % request_idx)
+            batch.execute(http=http)
+        if len(errors) > 0:
+            raise Exception("Failed to get instance groups : %s" % str(errors[0]))
+
+        instance_groups = [[] for node_pool in node_pools]
+        for request_idx, request in requests:
+            instance_groups[request_idx[0]].append(responses["%s-%s" % request_idx])
+        return instance_groups
         
     def get_info(self):
         location_params = self.get_location_params()
@@ -573,39 +639,85 @@ class Cluster(object):
             response = request.execute()
             node_pools = []
             for elem in response.get("nodePools", []):
-                node_pools.append(NodePool(elem["name"], self))
+                # the listing has the full definitions, no need to get() them again
+                node_pools.append(NodePool(elem["name"], self, elem))
             return node_pools
         except HttpError as e:
             raise Exception("Failed to get node pools : %s" % str(e))
         
-    def get_node_pool(self, node_pool_id):
+    def get_node_pool(self, node_pool_id, node_pools=None):
+        """
+        Get a node pool by name, reusing the definition from node_pools (from get_node_pools()) if it's in there
+        """
+        for node_pool in node_pools or []:
+            if node_pool.name == node_pool_id:
+                return node_pool
         return NodePool(node_pool_id, self)
     
 class Clusters(object):
     def __init__(self, project_id, zone, region, credentials=None):
         logging.info("Connect using project_id=%s zone=%s region=%s credentials=%s" % (project_id, zone, region, credentials))
         _configure_google_auth_env()
-        instance_info = get_instance_info()
-        if _is_none_or_blank(project_id):
-            default_project = instance_info["project"]
+        self.credentials = credentials
+        # the defaults and the API clients are only resolved when first needed
+        self._project_id = _default_if_blank(project_id, None)
+        self._zone = _default_if_blank(zone, None)
+        self._region = _default_if_blank(region, None)
+        self._service = None
+        self._compute = None
+        self._thread_local = threading.local()
+
+    @property
+    def project_id(self):
+        if self._project_id is None:
+            default_project = get_instance_info()["project"]
             logging.info("No project specified, using {} as default".format(default_project))
-            self.project_id = default_project
-        else:
-            self.project_id = project_id
-        if _is_none_or_blank(zone):
-            default_zone = instance_info["zone"]
+            self._project_id = default_project
+        return self._project_id
+
+    @property
+    def zone(self):
+        if self._zone is None:
+            default_zone = get_instance_info()["zone"]
             logging.info("No zone specified, using {} as default".format(default_zone))
-            self.zone = default_zone
-        else:
-            self.zone = zone
-        if _is_none_or_blank(region):
+            self._zone = default_zone
+        return self._zone
+
+    @property
+    def region(self):
+        if self._region is None:
             default_region = '-'.join(self.zone.split("-")[:-1])
             logging.info("No region specified, using {} as default".format(default_region))
-            self.region = default_region
-        else:
-            self.region = region
-        self.service = discovery.build('container', 'v1', credentials=credentials, cache_discovery=False)
-        self.compute = discovery.build('compute', 'v1', credentials=credentials, cache_discovery=False)
+            self._region = default_region
+        return self._region
+
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = build_client('container', 'v1', credentials=self.credentials)
+        return self._service
+
+    @property
+    def compute(self):
+        if self._compute is None:
+            self._compute = build_client('compute', 'v1', credentials=self.credentials)
+        return self._compute
+
+    def get_http(self):
+        """
+        Authorized http transport for the current thread, to execute requests from several threads
+        (the transport of the API clients is not thread-safe). Its calls time out after HTTP_TIMEOUT seconds.
+        """
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            import httplib2, google_auth_httplib2, google.auth, google.auth.credentials
+            credentials = self.credentials
+            if credentials is None:
+                credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+            credentials = google.auth.credentials.with_scopes_if_required(credentials, [CLOUD_PLATFORM_SCOPE])
+            http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            self._thread_local.http = http
+        return http
         
     def get_zonal_location(self):
         return "projects/%s/locations/%s" % (self.project_id, self.zone)
@@ -0,0 +1,75 @@
+import os, time, hashlib, threading
+import logging
+
+from dku_google.auth import get_credentials_from_json_or_file
+from dku_google.gcloud_credentials import get_gcloud_credentials
+from dku_google.clusters import Clusters
+from dku_utils.access import _is_none_or_blank
+
+# how long an unused Clusters is kept around
+CLUSTERS_IDLE_TTL = 30 * 60
+
+
+def _get_credentials_fingerprint(credentials_data):
+    if _is_none_or_blank(credentials_data):
+        return None
+    h = hashlib.sha256(credentials_data.encode('utf8'))
+    if os.path.exists(credentials_data):
+        # a path to a key file, which can be rotated in place
+        h.update(str(os.path.getmtime(credentials_data)).encode('utf8'))
+    return h.hexdigest()
+
+
+class ClustersPool(object):
+    """
+    Process-wide pool of Clusters, so that successive calls for the same project, location and
+    credentials reuse the same API clients (and their connections) instead of building new ones.
+    Tokens are not handled here: the API clients work on scoped copies of the credentials, which their
+    authorized transports refresh when needed.
+
+    All callers get the same Clusters, hence the same API clients, whose default httplib2 transport
+    isn't thread-safe: code calling the APIs from several threads must pass http=clusters.get_http()
+    to execute(), which gives each thread its own transport.
+    """
+    def __init__(self, idle_ttl=CLUSTERS_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def _evict_idle(self, now):
+        for key in list(self.entries.keys()):
+            if now - self.entries[key]['lastUsed'] > self.idle_ttl:
+                logging.info("Evicting idle clients for %s" % str(key[:3]))
+                del self.entries[key]
+
+    def get(self, project_id, zone, region, credentials_data=None, use_gcloud_credentials=False):
+        """
+        Clusters acting with the service account of credentials_data if set, else as the account gcloud is
+        logged in with if use_gcloud_credentials, else with the application default credentials
+        """
+        use_gcloud_credentials = use_gcloud_credentials and _is_none_or_blank(credentials_data)
+        key = (project_id, zone, region, _get_credentials_fingerprint(credentials_data), use_gcloud_credentials)
+        with self.lock:
+            now = time.time()
+            self._evict_idle(now)
+            entry = self.entries.get(key, None)
+            if entry is None:
+                credentials = None
+                if not _is_none_or_blank(credentials_data):
+                    credentials = get_credentials_from_json_or_file(credentials_data)
+                elif use_gcloud_credentials:
+                    # tokens from gcloud, cached until they're about to expire
+                    credentials = get_gcloud_credentials()
+                entry = {'clusters': Clusters(project_id, zone, region, credentials)}
+                self.entries[key] = entry
+            else:
+                logging.info("Reusing clients for project_id=%s zone=%s region=%s" % (project_id, zone, region))
+            entry['lastUsed'] = now
+            return entry['clusters']
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+CLUSTERS_POOL = ClustersPool()
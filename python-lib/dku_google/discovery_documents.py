@@ -0,0 +1,67 @@
+from googleapiclient import discovery
+from dku_utils.files import get_plugin_cache_dir, write_atomically
+
+import os, json, time, logging
+import requests
+
+DISCOVERY_DOCUMENT_TTL = 24 * 3600
+DISCOVERY_DOCUMENT_URL = "https://%s.googleapis.com/$discovery/rest?version=%s"
+
+DISCOVERY_DOCUMENTS = {}
+
+def _get_static_document(service, version):
+    # recent versions of the client library ship the discovery documents
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        return None
+    return get_static_doc(service, version)
+
+def _get_cached_document_path(service, version):
+    return os.path.join(get_plugin_cache_dir('discovery'), '%s.%s.json' % (service, version))
+
+def _fetch_document(service, version):
+    url = DISCOVERY_DOCUMENT_URL % (service, version)
+    logging.info("Fetching discovery document from %s" % url)
+    r = requests.get(url, timeout=30)
+    r.raise_for_status()
+    json.loads(r.text) # don't cache garbage
+    return r.text
+
+def get_discovery_document(service, version):
+    """
+    Get the discovery document of a Google API, looking in order into: this process, the documents
+    shipped with googleapiclient, the on-disk cache (if fresh enough), and finally the network.
+    """
+    key = (service, version)
+    if key in DISCOVERY_DOCUMENTS:
+        return DISCOVERY_DOCUMENTS[key]
+
+    document = _get_static_document(service, version)
+    if document is None:
+        cached_path = _get_cached_document_path(service, version)
+        is_fresh = os.path.exists(cached_path) and time.time() - os.path.getmtime(cached_path) < DISCOVERY_DOCUMENT_TTL
+        if is_fresh:
+            with open(cached_path, "r") as f:
+                document = f.read()
+        else:
+            try:
+                document = _fetch_document(service, version)
+                write_atomically(cached_path, document)
+            except Exception as e:
+                if not os.path.exists(cached_path):
+                    raise
+                logging.warning("Unable to refresh the discovery document of %s %s, using the stale cached one : %s" % (service, version, str(e)))
+                with open(cached_path, "r") as f:
+                    document = f.read()
+    DISCOVERY_DOCUMENTS[key] = document
+    return document
+
+def build_client(service, version, credentials=None):
+    """
+    Same as discovery.build(), without a network round trip when the discovery document is cached
+    """
+    start = time.time()
+    client = discovery.build_from_document(get_discovery_document(service, version), credentials=credentials)
+    logging.info("Built %s %s API client in %.3fs" % (service, version, time.time() - start))
+    return client
@@ -1,21 +1,73 @@
-import os, sys, json, yaml, subprocess, logging
+import os, sys, json, yaml, subprocess, logging, hashlib
 import socket
-import requests
+from six.moves import configparser
 
 from dku_utils.access import _safe_get_value
+from dku_utils.files import get_plugin_cache_dir, write_atomically, file_lock
+from dku_google.metadata import get_metadata_client
 
 GCLOUD_INFO = None
-METADATA_SERVER_BASE_URL="http://metadata/computeMetadata/v1/"
+GCLOUD_INFO_CACHE_FILE = "gcloud_info.json"
+
+def _find_gcloud():
+    for path_dir in os.environ.get("PATH", "").split(os.pathsep):
+        gcloud_path = os.path.join(path_dir, "gcloud")
+        if os.path.isfile(gcloud_path) and os.access(gcloud_path, os.X_OK):
+            return os.path.realpath(gcloud_path)
+    return None
+
+
+def _get_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def _get_gcloud_info_cache_key():
+    """
+    What `gcloud info` depends on: the SDK installation, the gcloud configuration and the active account
+    """
+
+    gcloud_path = _find_gcloud()
+    if gcloud_path is None:
+        return None
+    sdk_root = os.path.dirname(os.path.dirname(gcloud_path))
+    config_dir = _get_gcloud_config_dir()
+    key = [gcloud_path, _get_mtime(sdk_root), config_dir, _get_mtime(config_dir),
+           os.environ.get("CLOUDSDK_ACTIVE_CONFIG_NAME", None), _get_gcloud_configured_account()]
+    return hashlib.sha256(json.dumps(key).encode("utf8")).hexdigest()
+
 
 def _get_gcloud_info():
     global GCLOUD_INFO
-    if GCLOUD_INFO is None:
-        logging.info("Retrieving gcloud info")
+    if GCLOUD_INFO is not None:
+        return GCLOUD_INFO
+
+    cache_path = os.path.join(get_plugin_cache_dir(), GCLOUD_INFO_CACHE_FILE)
+    cache_key = _get_gcloud_info_cache_key()
+    if cache_key is not None and os.path.exists(cache_path):
         try:
-            gcloud_info_str = subprocess.check_output(["gcloud", "info", "--format", "json"])
-            GCLOUD_INFO = json.loads(gcloud_info_str)
-        except:
-            raise ValueError("gcloud CLI not found, check if Google Cloud SDK is properly installed and configured.")
+            with file_lock(cache_path + ".lock", shared=True):
+                with open(cache_path, "r") as f:
+                    cached = json.load(f)
+            if cached.get("key", None) == cache_key:
+                logging.info("Using cached gcloud info from %s" % cache_path)
+                GCLOUD_INFO = cached["info"]
+                return GCLOUD_INFO
+        except Exception as e:
+            logging.warning("Unable to read cached gcloud info from %s : %s" % (cache_path, str(e)))
+
+    logging.info("Retrieving gcloud info")
+    try:
+        gcloud_info_str = subprocess.check_output(["gcloud", "info", "--format", "json"])
+        GCLOUD_INFO = json.loads(gcloud_info_str)
+    except:
+        raise ValueError("gcloud CLI not found, check if Google Cloud SDK is properly installed and configured.")
+
+    if cache_key is not None:
+        try:
+            with file_lock(cache_path + ".lock"):
+                write_atomically(cache_path, json.dumps({"key": cache_key, "info": GCLOUD_INFO}))
+        except Exception as e:
+            logging.warning("Unable to cache gcloud info into %s : %s" % (cache_path, str(e)))
     return GCLOUD_INFO
 
 
@@ -65,110 +117,106 @@ def _run_cmd(cmd=None, **kwargs):
 def get_instance_info():
     """
     Retrieve the instance name, project, region and zone by calling the local
-    metadata server.
+    metadata server (once per process).
+    """
+
+    return get_metadata_client().get_instance_info()
+
+
+def _get_gcloud_config_dir():
+    if "CLOUDSDK_CONFIG" in os.environ:
+        return os.environ["CLOUDSDK_CONFIG"]
+    return os.path.join(os.path.expanduser("~"), ".config", "gcloud")
+
+
+def _get_gcloud_configured_account():
+    """
+    Read the account set in the active gcloud configuration from the config files, without running gcloud
     """
 
-    metadata_flavor = {"Metadata-Flavor": "Google"}
-    instance_info = {}
-    instance_info["project"] = requests.get("/".join([METADATA_SERVER_BASE_URL,
-                                                      "project",
-                                                      "project-id"]),
-                                            headers=metadata_flavor).text
-    zone_full = requests.get("/".join([METADATA_SERVER_BASE_URL,
-                                       "instance",
-                                       "zone"]),
-                        headers=metadata_flavor).text
-    zone = zone_full.split("/")[-1] 
-    instance_info["zone"] = zone
-    instance_info["region"] = '-'.join(zone.split("-")[:-1])
-    instance_info["vm_name"] = requests.get("/".join([METADATA_SERVER_BASE_URL,
-                                                      "instance",
-                                                      "name"]),
-                                            headers=metadata_flavor).text
-    return instance_info
-
-
-def get_instance_network():
+    if "CLOUDSDK_CORE_ACCOUNT" in os.environ:
+        return os.environ["CLOUDSDK_CORE_ACCOUNT"]
+    config_dir = _get_gcloud_config_dir()
+    config_name = os.environ.get("CLOUDSDK_ACTIVE_CONFIG_NAME", None)
+    if config_name is None:
+        active_config_path = os.path.join(config_dir, "active_config")
+        config_name = "default"
+        if os.path.exists(active_config_path):
+            with open(active_config_path, "r") as f:
+                config_name = f.read().strip() or "default"
+    config = configparser.RawConfigParser()
+    config.read(os.path.join(config_dir, "configurations", "config_%s" % config_name))
+    if config.has_option("core", "account"):
+        return config.get("core", "account")
+    return None
+
+
+HOST_NETWORK = None
+
+def get_instance_network(compute=None):
     """
-    Retrieve the network and subnetwork of the DSS host.
+    Retrieve the network and subnetwork of the DSS host (once per process).
+    The metadata server doesn't know about subnetworks, so this describes the instance with the
+    compute API client if one is given, and only falls back to gcloud if that fails.
     """
 
+    global HOST_NETWORK
+    if HOST_NETWORK is not None:
+        return HOST_NETWORK
     instance_info = get_instance_info()
-    cmd = ["gcloud", "compute", "instances", "describe"]
-    cmd += [
-                    instance_info["vm_name"],
-                    "--project",
-                    instance_info["project"],
-                    "--zone",
-                    instance_info["zone"],
-                    "--format=json"
-                ]   
-    instance_full_info = json.loads(_run_cmd(cmd))
+    instance_full_info = None
+    if compute is not None:
+        try:
+            instance_full_info = compute.instances().get(project=instance_info["project"],
+                                                         zone=instance_info["zone"],
+                                                         instance=instance_info["vm_name"]).execute()
+        except Exception as e:
+            logging.warning("Unable to describe the DSS host with the compute API, falling back to gcloud : %s" % str(e))
+    if instance_full_info is None:
+        cmd = ["gcloud", "compute", "instances", "describe"]
+        cmd += [
+                        instance_info["vm_name"],
+                        "--project",
+                        instance_info["project"],
+                        "--zone",
+                        instance_info["zone"],
+                        "--format=json"
+                    ]   
+        instance_full_info = json.loads(_run_cmd(cmd))
     network_interfaces = instance_full_info["networkInterfaces"]
     default_nic = network_interfaces[0]
     if len(network_interfaces) > 1:
         logging.info("WARNING! Multiple NICs detected, will use {}".format(default_nic))
     network = default_nic["network"]
     subnetwork = default_nic["subnetwork"]
-    return network, subnetwork
+    HOST_NETWORK = (network, subnetwork)
+    return HOST_NETWORK
+
 
+HOST_SERVICE_ACCOUNT = None
 
 def get_instance_service_account():
     """
-    Retrieve the active service account of the DSS host
+    Retrieve the active service account of the DSS host (once per process): the account set
+    in the gcloud configuration if any, otherwise the default service account of the instance.
     """
 
-    logging.info("Retrieving gcloud auth info")
-    cmd = ["gcloud", "auth", "list", "--format=json"]
-    instance_auth_info = json.loads(_run_cmd(cmd))
-    for identity in instance_auth_info:
-        if identity["status"] == "ACTIVE":
-            instance_active_sa = identity["account"]
+    global HOST_SERVICE_ACCOUNT
+    if HOST_SERVICE_ACCOUNT is not None:
+        return HOST_SERVICE_ACCOUNT
+    instance_active_sa = _get_gcloud_configured_account()
+    if instance_active_sa is None:
+        try:
+            instance_active_sa = get_metadata_client().get_metadata()["instance"]["serviceAccounts"]["default"]["email"]
+        except Exception as e:
+            logging.warning("Unable to get the default service account from the metadata server, falling back to gcloud : %s" % str(e))
+    if instance_active_sa is None:
+        logging.info("Retrieving gcloud auth info")
+        cmd = ["gcloud", "auth", "list", "--format=json"]
+        instance_auth_info = json.loads(_run_cmd(cmd))
+        for identity in instance_auth_info:
+            if identity["status"] == "ACTIVE":
+                instance_active_sa = identity["account"]
     logging.info("Active service account on DSS host is {}".format(instance_active_sa))
-    return instance_active_sa
-
-
-def create_kube_config_file(project_id, cluster_id, is_cluster_regional, region_or_zone, kube_config_path, is_dns_endpoint=False):
-    """
-    Delegate the creation of the kube config file to gke-gcloud-auth-plugin
-    Starting with Kubernetes 1.26, the authentication to execute kubectl commands on Google clusters
-        won't be available in kubectl anymore and the client go auth plugin needs to be used
-    The gke-gcloud-auth-plugin is installed on the machine directly from the image
-    It will keep an authentication token linked to the unix user on the machine for gcloud and kubectl calls
-    Command `gcloud container clusters get-credentials CLUSTER_NAME` configures the authentication
-        for the specified cluster, and creates an adequate kubeconfig file.
-    """
-
-    # Deleting the kube config for this cluster if it already exists
-    logging.info("Checking if a kube config file already exists")
-    if os.path.isfile(kube_config_path):
-        logging.info("Deleting existing kube config file: {}".format(kube_config_path))
-        os.remove(kube_config_path)
-    
-    # Configure the environment variables to use gcloud command
-    logging.info("Running command to activate gcloud auth plugin for cluster {}".format(cluster_id))
-    gcloud_env = os.environ.copy()
-    # Use the new client go auth plugin authentication mode
-    gcloud_env["USE_GKE_GCLOUD_AUTH_PLUGIN"] = "True"
-    # Provide the desired location for the kube config to override the default value used by the auth plugin
-    gcloud_env["KUBECONFIG"] = kube_config_path
-
-    # Build the command
-    cmd = ["gcloud", "container", "clusters", "get-credentials", cluster_id]
-    
-    if project_id is not None and len(project_id) > 0:
-        cmd.append("--project")
-        cmd.append(project_id)
-
-    if is_dns_endpoint:
-        cmd.append("--dns-endpoint")
-        
-    if is_cluster_regional:
-        cmd.append("--region")
-        cmd.append(region_or_zone)
-    else:
-        cmd.append("--zone")
-        cmd.append(region_or_zone)
-    
-    # Run the command
-    _run_cmd(cmd, env=gcloud_env)
+    HOST_SERVICE_ACCOUNT = instance_active_sa
+    return HOST_SERVICE_ACCOUNT
@@ -0,0 +1,116 @@
+import datetime, threading, time
+import logging
+
+import google.auth.credentials
+
+from dku_google.gcloud import get_access_token_and_expiry
+
+# tokens are refreshed this long before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+
+def _parse_expiry(expiry):
+    # config-helper gives RFC 3339 UTC timestamps, google-auth wants naive UTC datetimes
+    if expiry is None:
+        return None
+    expiry = expiry.rstrip('Z')
+    for expiry_format in ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"]:
+        try:
+            return datetime.datetime.strptime(expiry, expiry_format)
+        except ValueError:
+            pass
+    logging.warning("Unable to parse token expiry %s" % expiry)
+    return None
+
+
+class GcloudCredentials(google.auth.credentials.Credentials):
+    """
+    google-auth credentials giving the access token of the gcloud CLI, so that the API clients can
+    act as the gcloud user. The token is kept until refresh_margin seconds before it expires, and
+    refreshed in the background ahead of that, as long as the credentials were used since the previous
+    refresh (so that the background refreshes stop once nothing uses them). Refreshes are serialized,
+    so that concurrent callers don't each run gcloud.
+    """
+    def __init__(self, config=None, refresh_margin=TOKEN_REFRESH_MARGIN, background_refresh=True):
+        super(GcloudCredentials, self).__init__()
+        self.config = config if config is not None else {}
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self.lock = threading.Lock()
+        self.timer = None
+        self.last_used = None
+        self.last_refresh = None
+
+    def _expires_soon(self):
+        if self.expiry is None:
+            return False
+        return datetime.datetime.utcnow() >= self.expiry - datetime.timedelta(seconds=self.refresh_margin)
+
+    @property
+    def expired(self):
+        return self._expires_soon()
+
+    @property
+    def valid(self):
+        return self.token is not None and not self._expires_soon()
+
+    def before_request(self, request, method, url, headers):
+        self.last_used = time.time()
+        super(GcloudCredentials, self).before_request(request, method, url, headers)
+
+    def refresh(self, request):
+        self._refresh(force=False)
+
+    def _refresh(self, force):
+        with self.lock:
+            if self.valid and not force:
+                # refreshed by another thread while this one was waiting
+                return
+            token, expiry = get_access_token_and_expiry(self.config)
+            self.token = token
+            self.expiry = _parse_expiry(expiry)
+            self.last_refresh = time.time()
+            logging.info("Got gcloud access token expiring at %s" % self.expiry)
+            self._schedule_background_refresh()
+
+    def _schedule_background_refresh(self):
+        if not self.background_refresh or self.expiry is None:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        delay = (self.expiry - datetime.datetime.utcnow()).total_seconds() - self.refresh_margin
+        # a bit before the token is considered expired, so that callers never wait on gcloud
+        self.timer = threading.Timer(max(0, delay - 30), self._refresh_in_background)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop_background_refresh(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def _refresh_in_background(self):
+        if self.last_used is None or self.last_used < self.last_refresh:
+            logging.info("gcloud access token unused since its last refresh, stopping background refreshes")
+            self.timer = None
+            return
+        try:
+            self._refresh(force=True)
+        except Exception:
+            logging.exception("Failed to refresh the gcloud access token in the background")
+
+
+GCLOUD_CREDENTIALS = None
+GCLOUD_CREDENTIALS_LOCK = threading.Lock()
+
+def get_gcloud_credentials():
+    """
+    Process-wide GcloudCredentials, used as the credentials of Clusters when the connection asks for
+    the gcloud identity (see ClustersPool.get())
+    """
+    global GCLOUD_CREDENTIALS
+    with GCLOUD_CREDENTIALS_LOCK:
+        if GCLOUD_CREDENTIALS is None:
+            GCLOUD_CREDENTIALS = GcloudCredentials()
+    return GCLOUD_CREDENTIALS
@@ -0,0 +1,57 @@
+import os, threading, logging
+import requests
+
+# same variable as google-auth, so that a local stand-in server can be used instead of the real one
+METADATA_HOST_ENV = "GCE_METADATA_HOST"
+DEFAULT_METADATA_HOST = "metadata"
+# (connect, read) timeouts: the metadata server is local, so off-GCE we want to fail fast
+METADATA_TIMEOUT = (1, 5)
+
+
+class MetadataClient(object):
+    """
+    Client of the GCE metadata server, fetching everything in one recursive call and keeping the result
+    """
+    def __init__(self, host=None, timeout=METADATA_TIMEOUT):
+        if host is None:
+            host = os.environ.get(METADATA_HOST_ENV, DEFAULT_METADATA_HOST)
+        self.base_url = "http://%s/computeMetadata/v1/" % host
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Metadata-Flavor": "Google"})
+        self.lock = threading.Lock()
+        self.metadata = None
+
+    def get_metadata(self):
+        with self.lock:
+            if self.metadata is None:
+                logging.info("Retrieving instance metadata from %s" % self.base_url)
+                try:
+                    r = self.session.get(self.base_url, params={"recursive": "true"}, timeout=self.timeout)
+                    r.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    raise Exception("Unable to reach the metadata server at %s, is DSS running on a GCE instance? : %s" % (self.base_url, str(e)))
+                self.metadata = r.json()
+        return self.metadata
+
+    def get_instance_info(self):
+        metadata = self.get_metadata()
+        instance = metadata.get("instance", {})
+        zone = instance.get("zone", "").split("/")[-1]
+        return {
+            "project": metadata.get("project", {}).get("projectId", None),
+            "zone": zone,
+            "region": '-'.join(zone.split("-")[:-1]),
+            "vm_name": instance.get("name", None)
+        }
+
+
+METADATA_CLIENT = None
+METADATA_CLIENT_LOCK = threading.Lock()
+
+def get_metadata_client():
+    global METADATA_CLIENT
+    with METADATA_CLIENT_LOCK:
+        if METADATA_CLIENT is None:
+            METADATA_CLIENT = MetadataClient()
+    return METADATA_CLIENT
@@ -1,26 +1,280 @@
 from googleapiclient import discovery
 from googleapiclient.errors import HttpError
 
-import os, sys, json, time
+import os, sys, json, time, random
 import logging
 
+# GKE operations can take from a couple of seconds (resizes) to tens of minutes (cluster creation)
+CLUSTER_OPERATION_TIMEOUT = 60 * 60
+NODE_POOL_OPERATION_TIMEOUT = 30 * 60
+
+# (first interval, max interval) in seconds between two polls, per operation type
+POLLING_INTERVALS = {
+    'CREATE_CLUSTER': (5, 20),
+    'DELETE_CLUSTER': (5, 20),
+    'UPGRADE_MASTER': (5, 20),
+    'CREATE_NODE_POOL': (2, 15),
+    'DELETE_NODE_POOL': (2, 15),
+    'UPGRADE_NODES': (2, 15)
+}
+DEFAULT_POLLING_INTERVALS = (1, 10)
+
+
+class OperationWaitException(Exception):
+    def __init__(self, message, operation):
+        super(OperationWaitException, self).__init__(message)
+        self.operation = operation
+
+
+class PollingSchedule(object):
+    """
+    Delays between two polls of a long-running operation: a short first interval, then an
+    exponential backoff with jitter up to a cap, without ever sleeping past the deadline.
+    """
+    def __init__(self, first_interval, max_interval, timeout=None, backoff=1.5, jitter=0.2):
+        self.start_time = time.time()
+        self.deadline = None if timeout is None else self.start_time + timeout
+        self.next_interval = first_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def is_expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def sleep(self):
+        delay = self.next_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.deadline is not None:
+            delay = max(0, min(delay, self.deadline - time.time()))
+        time.sleep(delay)
+        self.next_interval = min(self.max_interval, self.next_interval * self.backoff)
+
+
+class OperationProgress(object):
+    """
+    Typed view of the 'progress' field of a GKE operation (itself made of nested stages)
+    """
+    def __init__(self, progress):
+        self.name = progress.get('name', '')
+        self.status = progress.get('status', '')
+        self.metrics = {}
+        for metric in progress.get('metrics', []):
+            if 'intValue' in metric:
+                self.metrics[metric.get('name', '')] = int(metric['intValue']) # int64 are strings in the API's json
+            elif 'doubleValue' in metric:
+                self.metrics[metric.get('name', '')] = float(metric['doubleValue'])
+            else:
+                self.metrics[metric.get('name', '')] = metric.get('stringValue', None)
+        self.stages = [OperationProgress(stage) for stage in progress.get('stages', [])]
+
+    def get_fraction(self):
+        """
+        Fraction of the work done, from the X_DONE/X_TOTAL metrics if any, otherwise from the stages. None if unknown
+        """
+        if self.status == 'DONE':
+            return 1.0
+        for name, value in self.metrics.items():
+            if not name.upper().endswith('_TOTAL') or not isinstance(value, (int, float)) or value <= 0:
+                continue
+            prefix = name[:-len('_TOTAL')]
+            for done_name in [prefix + '_DONE', prefix + '_COMPLETE']:
+                for k, v in self.metrics.items():
+                    if k.upper() == done_name.upper() and isinstance(v, (int, float)):
+                        return min(1.0, float(v) / value)
+        if len(self.stages) > 0:
+            return float(len([stage for stage in self.stages if stage.status == 'DONE'])) / len(self.stages)
+        return None
+
+    def to_json(self):
+        return {'name': self.name, 'status': self.status, 'metrics': self.metrics, 'stages': [stage.to_json() for stage in self.stages]}
+
+
+def to_dss_progress_callback(progress_callback):
+    """
+    Adapt a DSS macro progress_callback (expecting a percentage, see get_progress_target()) to Operation.wait_done()
+    """
+    def callback(operation_progress):
+        fraction = operation_progress.get_fraction()
+        if fraction is not None:
+            progress_callback(int(100 * fraction))
+    return callback
+
+
 class Operation(object):
     def __init__(self, operation, operations, location_data):
         self.operation = operation
+        self.stage_timings = []
         self.operation_id = operation["name"]
         self.operations = operations
         if 'region' in location_data:
             # the regional api uses the 'name' arg, not the old projectId/zone/... ones
+            self.list_params = {"parent": 'projects/%s/locations/%s' % (location_data['projectId'], location_data['region'])}
             location_data = {"name": 'projects/%s/locations/%s/operations/%s' % (location_data['projectId'], location_data['region'], self.operation_id)}
+        else:
+            self.list_params = location_data.copy()
         self.location_data = location_data
-        
+
     def _refresh(self):
         self.operation = self.operations.get(operationId=self.operation_id, **self.location_data).execute()
-        
+
     def is_done(self):
         return self.operation.get('status', '') == 'DONE'
-    
-    def wait_done(self):
+
+    def get_operation_type(self):
+        return self.operation.get('operationType', '')
+
+    def get_progress(self):
+        return OperationProgress(self.operation.get('progress', {}))
+
+    def _record_stage_timings(self, progress):
+        # the API doesn't timestamp the stages, so time them from what is observed between two polls
+        now = time.time()
+        for stage in progress.stages:
+            timing = None
+            for t in self.stage_timings:
+                if t['name'] == stage.name:
+                    timing = t
+            if timing is None:
+                timing = {'name': stage.name, 'status': None, 'started': None, 'ended': None, 'duration': None}
+                self.stage_timings.append(timing)
+            if timing['started'] is None and stage.status not in ['', 'STATUS_UNSPECIFIED', 'PENDING']:
+                timing['started'] = now
+            if timing['ended'] is None and stage.status == 'DONE':
+                timing['ended'] = now
+                timing['duration'] = now - timing['started'] if timing['started'] is not None else None
+            timing['status'] = stage.status
+
+    def get_timings(self):
+        return {
+            'operationType': self.get_operation_type(),
+            'startTime': self.operation.get('startTime', None),
+            'endTime': self.operation.get('endTime', None),
+            'stages': self.stage_timings
+        }
+
+    def get_polling_schedule(self, timeout=None):
+        first_interval, max_interval = POLLING_INTERVALS.get(self.get_operation_type(), DEFAULT_POLLING_INTERVALS)
+        return PollingSchedule(first_interval, max_interval, timeout=timeout)
+
+    def _on_progress(self, progress_callback):
+        progress = self.get_progress()
+        self._record_stage_timings(progress)
+        if progress_callback is not None:
+            progress_callback(progress)
+
+    def wait_done(self, timeout=None, cancel_hook=None, progress_callback=None):
+        """
+        Poll the operation until it's DONE. Gives up after timeout seconds (if not None), or as soon
+        as cancel_hook() returns True. Giving up only stops the wait, the operation itself goes on in GKE.
+        After each poll, progress_callback (if not None) gets the OperationProgress of the operation.
+        """
+        schedule = self.get_polling_schedule(timeout)
+        self._on_progress(progress_callback)
         while not self.is_done():
-            time.sleep(5)
+            if cancel_hook is not None and cancel_hook():
+                raise OperationWaitException("Stopped waiting for operation %s after %.1fs" % (self.operation_id, schedule.elapsed()), self)
+            if schedule.is_expired():
+                raise OperationWaitException("Operation %s did not finish after %ss" % (self.operation_id, timeout), self)
+            schedule.sleep()
+            self._refresh()
+            self._on_progress(progress_callback)
+        logging.info("Operation %s (%s) done after %.1fs" % (self.operation_id, self.get_operation_type(), schedule.elapsed()))
+
+
+class OperationGroup(object):
+    """
+    Wait on several operations at once, with one operations.list() call per location and per poll
+    instead of one operations.get() per operation.
+    """
+    def __init__(self, operations=None):
+        self.pending = []
+        self.done = []
+        self.callbacks = {}
+        for operation in operations or []:
+            self.add(operation)
+
+    def add(self, operation, callback=None):
+        """
+        Track an operation. The optional callback is called with the operation as soon as it's DONE.
+        """
+        if callback is not None:
+            self.callbacks[operation.operation_id] = callback
+        self.pending.append(operation)
+        return operation
+
+    def _get_polling_schedule(self, timeout):
+        intervals = [POLLING_INTERVALS.get(operation.get_operation_type(), DEFAULT_POLLING_INTERVALS) for operation in self.pending]
+        if len(intervals) == 0:
+            intervals = [DEFAULT_POLLING_INTERVALS]
+        return PollingSchedule(min([i[0] for i in intervals]), min([i[1] for i in intervals]), timeout=timeout)
+
+    def _refresh(self):
+        by_location = {}
+        for operation in self.pending:
+            key = json.dumps(operation.list_params, sort_keys=True)
+            by_location.setdefault(key, []).append(operation)
+        for operations in by_location.values():
+            operations_api = operations[0].operations
+            response = operations_api.list(**operations[0].list_params).execute()
+            listed = {}
+            for elem in response.get("operations", []):
+                listed[elem.get("name", None)] = elem
+            for operation in operations:
+                if operation.operation_id in listed:
+                    operation.operation = listed[operation.operation_id]
+                else:
+                    # not in the listing (zone missing from the response, or operation already purged)
+                    operation._refresh()
+                operation._record_stage_timings(operation.get_progress())
+
+    def _collect_done(self):
+        newly_done = [operation for operation in self.pending if operation.is_done()]
+        for operation in newly_done:
+            self.pending.remove(operation)
+            self.done.append(operation)
+            callback = self.callbacks.pop(operation.operation_id, None)
+            if callback is not None:
+                callback(operation)
+        return newly_done
+
+    def get_progress(self):
+        """
+        Progress of the group as a whole, with one stage per operation (or the progress of the operation if
+        there is only one)
+        """
+        if len(self.done) + len(self.pending) == 1:
+            return (self.done + self.pending)[0].get_progress()
+        stages = [dict(operation.operation.get('progress', {}), status='DONE') for operation in self.done]
+        stages += [operation.operation.get('progress', {}) for operation in self.pending]
+        return OperationProgress({'name': 'operations', 'status': 'DONE' if len(self.pending) == 0 else 'RUNNING', 'stages': stages})
+
+    def as_completed(self, timeout=None, cancel_hook=None, progress_callback=None):
+        """
+        Yield the operations as they reach DONE. Same timeout, cancel_hook and progress_callback semantics as
+        Operation.wait_done(), progress_callback getting the progress of the group (see get_progress())
+        """
+        schedule = self._get_polling_schedule(timeout)
+        for operation in self._collect_done():
+            yield operation
+        if progress_callback is not None:
+            progress_callback(self.get_progress())
+        while len(self.pending) > 0:
+            if cancel_hook is not None and cancel_hook():
+                raise OperationWaitException("Stopped waiting for %s operations after %.1fs" % (len(self.pending), schedule.elapsed()), self.pending[0])
+            if schedule.is_expired():
+                raise OperationWaitException("%s operations did not finish after %ss" % (len(self.pending), timeout), self.pending[0])
+            schedule.sleep()
             self._refresh()
+            for operation in self._collect_done():
+                logging.info("Operation %s (%s) done after %.1fs" % (operation.operation_id, operation.get_operation_type(), schedule.elapsed()))
+                yield operation
+            if progress_callback is not None:
+                progress_callback(self.get_progress())
+
+    def wait_done(self, timeout=None, cancel_hook=None, progress_callback=None):
+        for operation in self.as_completed(timeout, cancel_hook, progress_callback):
+            pass
+        return self.done
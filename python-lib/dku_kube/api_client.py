@@ -0,0 +1,230 @@
+import os, json, yaml, base64, tempfile, atexit, threading, datetime, calendar, time, logging
+import requests
+
+from dku_kube.kubeconfig import get_first_kube_config
+from dku_kube.kubectl_command import run_with_timeout
+from dku_utils.access import _is_none_or_blank
+
+# (API path, plural, is namespaced) of the kinds of resources the plugin deals with
+RESOURCES = {
+    "Pod": ("api/v1", "pods", True),
+    "Node": ("api/v1", "nodes", False),
+    "DaemonSet": ("apis/apps/v1", "daemonsets", True),
+    "ClusterRoleBinding": ("apis/rbac.authorization.k8s.io/v1", "clusterrolebindings", False)
+}
+FIELD_MANAGER = "dss-plugin-gke-clusters"
+# (connect, read) timeouts of the calls to the API server
+API_TIMEOUT = (5, 30)
+# tokens from exec plugins are renewed this long before they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+# tokens obtained from exec plugins, shared by all the clients of the process
+EXEC_TOKENS = {}
+EXEC_TOKENS_LOCK = threading.Lock()
+
+
+class KubeApiException(Exception):
+    def __init__(self, message, status_code, body):
+        super(KubeApiException, self).__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def _parse_timestamp(timestamp):
+    # RFC 3339 timestamps, as seconds since epoch
+    if _is_none_or_blank(timestamp):
+        return None
+    timestamp = timestamp.rstrip('Z').split('.')[0]
+    return calendar.timegm(datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S").timetuple())
+
+
+def _to_temp_file(data_b64, suffix):
+    f = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    f.write(base64.b64decode(data_b64))
+    f.close()
+    atexit.register(lambda: os.path.exists(f.name) and os.remove(f.name))
+    return f.name
+
+
+class KubeApiClient(object):
+    """
+    Minimal client of the Kubernetes API for the few kinds of resources the plugin touches, using the
+    current context of a kube config file. Calls go through one pooled HTTPS session, and the token of
+    exec plugins (like gke-gcloud-auth-plugin) is cached until it expires, instead of spawning kubectl
+    and the plugin for each operation.
+    """
+    def __init__(self, kube_config_path=None):
+        kube_config_path = get_first_kube_config(kube_config_path)
+        with open(kube_config_path, "r") as f:
+            kube_config = yaml.safe_load(f)
+        context_name = kube_config.get("current-context", None)
+        context = self._find(kube_config, "contexts", context_name)["context"]
+        self.cluster = self._find(kube_config, "clusters", context["cluster"])["cluster"]
+        self.user = self._find(kube_config, "users", context["user"]).get("user", {})
+        self.server = self.cluster["server"].rstrip('/')
+
+        self.session = requests.Session()
+        if self.cluster.get("insecure-skip-tls-verify", False):
+            self.session.verify = False
+        elif "certificate-authority-data" in self.cluster:
+            self.session.verify = _to_temp_file(self.cluster["certificate-authority-data"], ".crt")
+        elif "certificate-authority" in self.cluster:
+            self.session.verify = self.cluster["certificate-authority"]
+        if "client-certificate-data" in self.user and "client-key-data" in self.user:
+            self.session.cert = (_to_temp_file(self.user["client-certificate-data"], ".crt"), _to_temp_file(self.user["client-key-data"], ".key"))
+        logging.info("Kubernetes API client for context %s at %s" % (context_name, self.server))
+
+    @staticmethod
+    def _find(kube_config, k, name):
+        for element in kube_config.get(k, []):
+            if element.get("name", None) == name:
+                return element
+        raise Exception("No %s named %s in kube config" % (k[:-1], name))
+
+    def _get_exec_token_key(self):
+        exec_config = self.user["exec"]
+        return json.dumps([self.server, exec_config.get("command"), exec_config.get("args", [])])
+
+    def _run_exec_plugin(self):
+        exec_config = self.user["exec"]
+        env = os.environ.copy()
+        for env_var in exec_config.get("env", None) or []:
+            env[env_var["name"]] = env_var["value"]
+        exec_credential = {"apiVersion": exec_config.get("apiVersion"), "kind": "ExecCredential", "spec": {"interactive": False}}
+        if exec_config.get("provideClusterInfo", False):
+            exec_credential["spec"]["cluster"] = {"server": self.server}
+            if "certificate-authority-data" in self.cluster:
+                exec_credential["spec"]["cluster"]["certificate-authority-data"] = self.cluster["certificate-authority-data"]
+        env["KUBERNETES_EXEC_INFO"] = json.dumps(exec_credential)
+        out, err = run_with_timeout([exec_config["command"]] + (exec_config.get("args", None) or []), env=env, timeout=30)
+        status = json.loads(out).get("status", {})
+        return status["token"], _parse_timestamp(status.get("expirationTimestamp", None))
+
+    def _get_token(self, renew=False):
+        if "token" in self.user:
+            return self.user["token"]
+        if "exec" not in self.user:
+            return None
+        key = self._get_exec_token_key()
+        with EXEC_TOKENS_LOCK:
+            token, expiry = EXEC_TOKENS.get(key, (None, None))
+            if renew or token is None or (expiry is not None and time.time() > expiry - TOKEN_EXPIRY_MARGIN):
+                logging.info("Getting token from %s" % self.user["exec"]["command"])
+                token, expiry = self._run_exec_plugin()
+                EXEC_TOKENS[key] = (token, expiry)
+            return token
+
+    def _request(self, method, path, renew_token=False, **kwargs):
+        headers = kwargs.pop("headers", {})
+        token = self._get_token(renew_token)
+        if token is not None:
+            headers["Authorization"] = "Bearer %s" % token
+        kwargs.setdefault("timeout", API_TIMEOUT)
+        r = self.session.request(method, self.server + path, headers=headers, **kwargs)
+        if r.status_code == 401 and not renew_token and "exec" in self.user:
+            # the token was revoked or expired early
+            return self._request(method, path, renew_token=True, headers=headers, **kwargs)
+        return r
+
+    @staticmethod
+    def _get_path(kind, name=None, namespace=None):
+        if kind not in RESOURCES:
+            raise Exception("Unsupported kind of resource %s" % kind)
+        api_path, plural, is_namespaced = RESOURCES[kind]
+        path = "/%s" % api_path
+        if is_namespaced and namespace is not None:
+            path += "/namespaces/%s" % namespace
+        path += "/%s" % plural
+        if name is not None:
+            path += "/%s" % name
+        return path
+
+    @staticmethod
+    def _check(r, action):
+        if r.status_code >= 300:
+            raise KubeApiException("Failed to %s : %s %s" % (action, r.status_code, r.text), r.status_code, r.text)
+        return r.json()
+
+    def get(self, kind, name, namespace=None):
+        """
+        Get a resource, or None if it doesn't exist
+        """
+        r = self._request("GET", self._get_path(kind, name, namespace))
+        if r.status_code == 404:
+            return None
+        return self._check(r, "get %s %s" % (kind, name))
+
+    def list(self, kind, namespace=None, label_selector=None, field_selector=None):
+        params = {}
+        if label_selector is not None:
+            params["labelSelector"] = label_selector
+        if field_selector is not None:
+            params["fieldSelector"] = field_selector
+        r = self._request("GET", self._get_path(kind, namespace=namespace), params=params)
+        return self._check(r, "list %s" % kind)
+
+    def create(self, manifest):
+        kind, metadata = manifest["kind"], manifest.get("metadata", {})
+        r = self._request("POST", self._get_path(kind, namespace=metadata.get("namespace", "default")), json=manifest)
+        return self._check(r, "create %s %s" % (kind, metadata.get("name")))
+
+    def apply(self, manifest):
+        """
+        Server-side apply of the manifest, the equivalent of kubectl apply
+        """
+        kind, metadata = manifest["kind"], manifest.get("metadata", {})
+        r = self._request("PATCH", self._get_path(kind, metadata["name"], metadata.get("namespace", "default")),
+                          params={"fieldManager": FIELD_MANAGER, "force": "true"},
+                          headers={"Content-Type": "application/apply-patch+yaml"},
+                          data=json.dumps(manifest))
+        return self._check(r, "apply %s %s" % (kind, metadata["name"]))
+
+    def delete(self, kind, name, namespace=None, grace_period_seconds=None):
+        """
+        Request the deletion of a resource (without waiting for it to be gone). Returns False if it didn't exist
+        """
+        params = {}
+        if grace_period_seconds is not None:
+            params["gracePeriodSeconds"] = grace_period_seconds
+        r = self._request("DELETE", self._get_path(kind, name, namespace), params=params)
+        if r.status_code == 404:
+            return False
+        self._check(r, "delete %s %s" % (kind, name))
+        return True
+
+    def watch(self, kind, namespace=None, field_selector=None, resource_version=None, timeout=None):
+        """
+        Yield the watch events ({"type":..., "object":...}) on resources of a kind, for at most timeout seconds
+        """
+        params = {"watch": "true"}
+        if field_selector is not None:
+            params["fieldSelector"] = field_selector
+        if resource_version is not None:
+            params["resourceVersion"] = resource_version
+        if timeout is not None:
+            params["timeoutSeconds"] = max(1, int(timeout))
+        r = self._request("GET", self._get_path(kind, namespace=namespace), params=params, stream=True,
+                          timeout=(API_TIMEOUT[0], timeout + API_TIMEOUT[0] if timeout is not None else None))
+        if r.status_code >= 300:
+            self._check(r, "watch %s" % kind)
+        try:
+            for line in r.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            r.close()
+
+
+KUBE_API_CLIENTS = {}
+KUBE_API_CLIENTS_LOCK = threading.Lock()
+
+def get_kube_api_client(kube_config_path=None):
+    """
+    Process-wide client for a kube config file (rebuilt if the file changes)
+    """
+    kube_config_path = get_first_kube_config(kube_config_path)
+    key = (os.path.abspath(kube_config_path), os.path.getmtime(kube_config_path))
+    with KUBE_API_CLIENTS_LOCK:
+        if key not in KUBE_API_CLIENTS:
+            KUBE_API_CLIENTS[key] = KubeApiClient(kube_config_path)
+        return KUBE_API_CLIENTS[key]
@@ -1,15 +1,28 @@
-import os, sys, json, yaml, logging, random, time
+import os, json, logging, random, time, threading
 from .kubectl_command import run_with_timeout
+from .api_client import get_kube_api_client
+
+# includes scheduling and pulling the image
+DEFAULT_START_TIMEOUT = 60
+DEFAULT_DELETE_GRACE_PERIOD = 5
+# container states in which the pod won't get running by itself
+FAILED_WAITING_REASONS = ['ErrImagePull', 'ImagePullBackOff', 'InvalidImageName', 'CreateContainerConfigError']
 
 class BusyboxPod(object):
-    def __init__(self, kube_config_path):
+    def __init__(self, kube_config_path, start_timeout=DEFAULT_START_TIMEOUT, delete_grace_period=DEFAULT_DELETE_GRACE_PERIOD, node_selector=None, tolerations=None):
         self.env = os.environ.copy()
         self.env['KUBECONFIG'] = kube_config_path
+        self.client = get_kube_api_client(kube_config_path)
+        self.start_timeout = start_timeout
+        self.delete_grace_period = delete_grace_period
+        self.node_selector = node_selector
+        self.tolerations = tolerations
+        self.node_name = None
         uid = ''.join([random.choice('abcdefghijklmnopqrstuvwxyz0123456789') for i in range(0,8)])
         self.pod_name = "busybox-" + uid
-        
+
     def __enter__(self):
-        # create pod
+        # create pod (the manifest is sent as is, nothing written to disk, so several can run at once)
         pod_yaml = {
             "apiVersion": "v1",
             "kind": "Pod",
@@ -29,47 +42,84 @@ class BusyboxPod(object):
                 "restartPolicy": "Always"
             }
         }
-        pod_file_path = 'busybox_pod.yaml'
-        with open(pod_file_path, "w") as f:
-            yaml.safe_dump(pod_yaml, f)
+        if self.node_selector is not None:
+            pod_yaml["spec"]["nodeSelector"] = self.node_selector
+        if self.tolerations is not None:
+            pod_yaml["spec"]["tolerations"] = self.tolerations
+        logging.info("Create pod %s" % self.pod_name)
+        pod = self.client.create(pod_yaml)
 
-        cmd = ['kubectl', 'create', '-f', os.path.abspath(pod_file_path)]
-        logging.info("Create pod with : %s" % json.dumps(cmd))
-        run_with_timeout(cmd, env=self.env, timeout=5)
-        
         # wait for it to actually run (could be stuck in pending if no resource available)
-        waited = 0
-        pod_state = self.get_pod_state()
-        while pod_state != 'running' and waited < 10:
-            time.sleep(1)
-            waited += 1
-            pod_state = self.get_pod_state()
-        
-        if pod_state != 'running':
+        try:
+            pod = self._wait_running(pod)
+        except:
             self.delete_pod()
-            raise Exception('Busybox did not start in 10s')
-            
+            raise
+        self.node_name = pod.get('spec', {}).get('nodeName', None)
+        logging.info("Pod %s running on node %s" % (self.pod_name, self.node_name))
         return self
-    
-    def get_pod_state(self):
-        cmd = ['kubectl', 'get', 'pod', self.pod_name, '-o', 'json']
-        logging.info("Poll pod state with : %s" % json.dumps(cmd))
-        out, err = run_with_timeout(cmd, env=self.env, timeout=5)
-        return json.loads(out)['status']['phase'].lower()
+
+    @staticmethod
+    def _get_waiting_reason(pod):
+        for container_status in pod.get('status', {}).get('containerStatuses', []):
+            waiting = container_status.get('state', {}).get('waiting', None)
+            if waiting is not None:
+                return waiting.get('reason', None)
+        return None
+
+    def _wait_running(self, pod):
+        start = time.time()
+        deadline = start + self.start_timeout
+        while True:
+            phase = pod.get('status', {}).get('phase', '').lower()
+            waiting_reason = BusyboxPod._get_waiting_reason(pod)
+            if phase == 'running':
+                logging.info("Pod %s started in %.1fs" % (self.pod_name, time.time() - start))
+                return pod
+            if phase in ['failed', 'succeeded'] or waiting_reason in FAILED_WAITING_REASONS:
+                raise Exception('Busybox failed to start: %s %s' % (phase, waiting_reason or ''))
+            if time.time() >= deadline:
+                raise Exception('Busybox did not start in %ss (%s %s)' % (self.start_timeout, phase, waiting_reason or ''))
+            # watch the pod from the last known version, until it changes state or the watch times out
+            resource_version = pod['metadata']['resourceVersion']
+            for event in self.client.watch("Pod", namespace="default", field_selector="metadata.name=%s" % self.pod_name,
+                                           resource_version=resource_version, timeout=deadline - time.time()):
+                if event.get('type', None) in ['ADDED', 'MODIFIED']:
+                    pod = event['object']
+                    break
+                elif event.get('type', None) == 'DELETED':
+                    raise Exception('Busybox was deleted while starting')
+                elif event.get('type', None) == 'ERROR':
+                    # typically the resource version is too old, start over from the current state
+                    pod = self.client.get("Pod", self.pod_name, namespace="default")
+                    break
 
     def delete_pod(self):
-        cmd = ['kubectl', 'delete', 'pods', self.pod_name]
-        logging.info("Delete pod with : %s" % json.dumps(cmd))
-        run_with_timeout(cmd, env=self.env, timeout=3, nokill=True) # fire and forget
-    
+        """
+        Request the deletion in a separate (non-daemon) thread, so that the caller doesn't wait for it
+        but the process doesn't exit before the request is sent
+        """
+        def delete():
+            for attempt in range(0, 3):
+                try:
+                    logging.info("Delete pod %s" % self.pod_name)
+                    self.client.delete("Pod", self.pod_name, namespace="default", grace_period_seconds=self.delete_grace_period)
+                    return
+                except Exception as e:
+                    logging.warning("Failed to delete pod %s : %s" % (self.pod_name, str(e)))
+                    time.sleep(1)
+            logging.error("Gave up deleting pod %s" % self.pod_name)
+        t = threading.Thread(target=delete)
+        t.start()
+        return t
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.delete_pod()
         logging.info("Exited busybox")
         return False
-    
+
     def exec_cmd(self, cmd, timeout=5):
         kcmd = ['kubectl', 'exec', self.pod_name, '--'] + cmd
         logging.info("Execute in pod with : %s" % json.dumps(kcmd))
         out, err = run_with_timeout(kcmd, env=self.env, timeout=timeout)
         return out, err
-    
\ No newline at end of file
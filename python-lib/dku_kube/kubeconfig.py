@@ -1,5 +1,14 @@
 import os, sys, json, yaml, logging
-from dku_utils.access import _has_not_blank_property, _is_none_or_blank
+from dku_utils.access import _has_not_blank_property, _is_none_or_blank, _safe_get_value
+from dku_utils.files import write_atomically, lock_file
+from dku_google.gcloud import get_sdk_root
+
+GKE_AUTH_PLUGIN = "gke-gcloud-auth-plugin"
+GKE_AUTH_PLUGIN_INSTALL_HINT = "Install gke-gcloud-auth-plugin for use with kubectl by following https://cloud.google.com/kubernetes-engine/docs/how-to/cluster-access-for-kubectl#install_plugin"
+# the C implementations are much faster on large kube configs, when libyaml is available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+MAX_LOGGED_NAMES = 10
 
 def get_first_kube_config(kube_config_path=None):
     if kube_config_path is None:
@@ -9,41 +18,107 @@ def get_first_kube_config(kube_config_path=None):
             kube_config_path = os.path.join(os.environ['HOME'], '.kube', 'config')
     return kube_config_path
 
+def _merge_elements(elements, new_elements):
+    # index the existing elements once, instead of scanning them for each new element
+    index = {}
+    for i in range(0, len(elements)):
+        index[elements[i].get("name", None)] = i
+    replaced, appended = [], []
+    for new_element in new_elements:
+        name = new_element.get("name", "")
+        if name in index:
+            elements[index[name]] = new_element
+            replaced.append(name)
+        else:
+            index[name] = len(elements)
+            elements.append(new_element)
+            appended.append(name)
+    return replaced, appended
+
+def _names_for_log(names):
+    if len(names) > MAX_LOGGED_NAMES:
+        return "%s and %s more" % (', '.join(names[:MAX_LOGGED_NAMES]), len(names) - MAX_LOGGED_NAMES)
+    return ', '.join(names)
+
 def merge_or_write_config(config, kube_config_path=None):
-    kube_config_path = get_first_kube_config(kube_config_path)
-    
-    if os.path.exists(kube_config_path):
-        logging.info("A kube config exists at %s => merging" % kube_config_path)
-        with open(kube_config_path, "r") as f:
-            existing = yaml.safe_load(f)
-        for k in ['users', 'clusters', 'contexts']:
-            elements = existing.get(k, [])
-            existing[k] = elements
-            new_elements = config.get(k, [])
-            for new_element in new_elements:
-                name = new_element.get("name", "")
-                element_idx = None
-                for i in range(0, len(elements)):
-                    if elements[i].get("name", None) == name:
-                        element_idx = i
-                logging.info("  %s > %s : %s" % (k, name, 'replace' if element_idx is not None else 'append'))
-                if element_idx is not None:
-                    elements[element_idx] = new_element
-                else:
-                    elements.append(new_element)
-        """
-        if len(config.get("current-context", "")) > 0:
-            current_context = config.get("current-context")
-            logging.info("Setting current context to %s" % current_context)
-            existing["current-context"] = current_context
-        """
-        
-        logging.info("Final state is %s" % json.dumps(existing, indent=2))
-            
-        with open(kube_config_path, "w") as f:
-            yaml.safe_dump(existing, f)
-    else:
-        logging.info("No kube config file found at %s => writing" % kube_config_path)
+    """
+    Merge the users, clusters and contexts of config into the kube config file (replacing those with the
+    same name), or write config if the file doesn't exist. The file is locked like kubectl does while it's
+    read and rewritten, and replaced atomically, so that concurrent merges don't lose or corrupt entries.
+    """
+    kube_config_path = os.path.realpath(get_first_kube_config(kube_config_path))
 
-        with open(kube_config_path, "w") as f:
-            yaml.safe_dump(config, f)
+    with lock_file(kube_config_path + ".lock"):
+        if os.path.exists(kube_config_path):
+            logging.info("A kube config exists at %s => merging" % kube_config_path)
+            with open(kube_config_path, "r") as f:
+                existing = yaml.load(f, Loader=YAML_LOADER) or {}
+            for k in ['users', 'clusters', 'contexts']:
+                elements = existing.get(k, None) or []
+                existing[k] = elements
+                replaced, appended = _merge_elements(elements, config.get(k, []))
+                # only names are logged, the elements hold credentials
+                logging.info("  %s > replaced %s, appended %s (%s in total)" % (k, _names_for_log(replaced) or '-', _names_for_log(appended) or '-', len(elements)))
+            """
+            if len(config.get("current-context", "")) > 0:
+                current_context = config.get("current-context")
+                logging.info("Setting current context to %s" % current_context)
+                existing["current-context"] = current_context
+            """
+        else:
+            logging.info("No kube config file found at %s => writing" % kube_config_path)
+            existing = config
+
+        write_atomically(kube_config_path, yaml.dump(existing, Dumper=YAML_DUMPER, default_flow_style=False))
+
+
+def _get_auth_plugin_command():
+    # like gcloud: the plugin's name if it's on the PATH, otherwise its path in the SDK
+    for path_dir in os.environ.get("PATH", "").split(os.pathsep):
+        if os.access(os.path.join(path_dir, GKE_AUTH_PLUGIN), os.X_OK):
+            return GKE_AUTH_PLUGIN
+    sdk_root = get_sdk_root()
+    if sdk_root is not None and os.access(os.path.join(sdk_root, "bin", GKE_AUTH_PLUGIN), os.X_OK):
+        return os.path.join(sdk_root, "bin", GKE_AUTH_PLUGIN)
+    logging.warning("%s not found, kubectl commands will fail" % GKE_AUTH_PLUGIN)
+    return GKE_AUTH_PLUGIN
+
+def write_kube_config_from_cluster_info(project_id, cluster_info, kube_config_path, is_dns_endpoint=False):
+    """
+    Write the kube config that `gcloud container clusters get-credentials` would, straight from the
+    cluster definition returned by GKE, instead of running gcloud. Authentication goes through the
+    gke-gcloud-auth-plugin, like with gcloud.
+    """
+    context_name = "gke_%s_%s_%s" % (project_id, cluster_info["location"], cluster_info["name"])
+    if is_dns_endpoint:
+        dns_endpoint = _safe_get_value(cluster_info, ["controlPlaneEndpointsConfig", "dnsEndpointConfig", "endpoint"], None)
+        if _is_none_or_blank(dns_endpoint):
+            raise Exception("Cluster %s has no DNS endpoint configured" % cluster_info["name"])
+        # the DNS endpoint has a publicly trusted certificate
+        cluster = {"server": "https://%s" % dns_endpoint}
+    else:
+        cluster = {
+            "certificate-authority-data": cluster_info["masterAuth"]["clusterCaCertificate"],
+            "server": "https://%s" % cluster_info["endpoint"]
+        }
+    kube_config = {
+        "apiVersion": "v1",
+        "clusters": [{"cluster": cluster, "name": context_name}],
+        "contexts": [{"context": {"cluster": context_name, "user": context_name}, "name": context_name}],
+        "current-context": context_name,
+        "kind": "Config",
+        "preferences": {},
+        "users": [{
+            "name": context_name,
+            "user": {
+                "exec": {
+                    "apiVersion": "client.authentication.k8s.io/v1beta1",
+                    "command": _get_auth_plugin_command(),
+                    "installHint": GKE_AUTH_PLUGIN_INSTALL_HINT,
+                    "provideClusterInfo": True
+                }
+            }
+        }]
+    }
+    logging.info("Writing kube config for context %s to %s" % (context_name, kube_config_path))
+    write_atomically(kube_config_path, yaml.safe_dump(kube_config, default_flow_style=False))
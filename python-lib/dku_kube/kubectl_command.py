@@ -1,31 +1,69 @@
-import os, sys, json, yaml, logging, subprocess, time
+import os, sys, json, yaml, logging, subprocess, time, threading, collections
+
+# timings of the last commands run, for diagnosis
+COMMAND_TIMINGS = collections.deque(maxlen=100)
 
 class KubeCommandException(Exception):
     def __init__(self, message, out, err):
         super(KubeCommandException, self).__init__(message)
         self.out = out
         self.err = err
-        
-def run_with_timeout(cmd, env=None, timeout=3, nokill=False):
-    p = subprocess.Popen(cmd, 
-                         stdout=subprocess.PIPE, 
+
+def _start_reader(stream, lines, stream_name, output_callback):
+    def read():
+        for line in iter(stream.readline, ''):
+            lines.append(line)
+            if output_callback is not None:
+                output_callback(stream_name, line)
+        stream.close()
+    t = threading.Thread(target=read)
+    t.daemon = True
+    t.start()
+    return t
+
+def _record_timing(cmd, start, rv):
+    duration = time.time() - start
+    COMMAND_TIMINGS.append({"cmd": cmd, "duration": duration, "returnCode": rv})
+    logging.info("Command %s %s after %.3fs" % (json.dumps(cmd), "finished with %s" % rv if rv is not None else "still running", duration))
+
+def get_command_timings():
+    return list(COMMAND_TIMINGS)
+
+def run_with_timeout(cmd, env=None, timeout=3, nokill=False, output_callback=None):
+    """
+    Run cmd, for at most timeout seconds (fractions allowed). stdout and stderr are read as they come, so
+    that a large output can't fill the pipes and block the process, and passed line by line to
+    output_callback(stream_name, line) if set. With nokill, a process still running after the timeout is
+    left alone and (None, None) is returned.
+    """
+    start = time.time()
+    deadline = start + timeout
+    p = subprocess.Popen(cmd,
+                         stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE,
                          env=env,
                          universal_newlines=True)
-    waited = 0
-    while waited < timeout and p.poll() is None:
-        time.sleep(1)
-        waited += 1
+    out_lines, err_lines = [], []
+    readers = [_start_reader(p.stdout, out_lines, 'stdout', output_callback),
+               _start_reader(p.stderr, err_lines, 'stderr', output_callback)]
+    # the pipes close when the process exits (or closes them itself)
+    for reader in readers:
+        reader.join(max(0, deadline - time.time()))
+    while p.poll() is None and time.time() < deadline:
+        time.sleep(0.01)
     if p.poll() is None:
+        _record_timing(cmd, start, None)
         if nokill:
             return None, None
         else:
             p.kill()
             raise Exception("Process did not finish after %s" % timeout)
-    out, err = p.communicate()
-    rv = p.wait()
+    for reader in readers:
+        # a child of the process may still hold the pipes
+        reader.join(max(0.1, deadline - time.time()))
+    rv = p.returncode
+    _record_timing(cmd, start, rv)
+    out, err = ''.join(out_lines), ''.join(err_lines)
     if rv != 0:
         raise KubeCommandException("Command failed with %s" % rv, out, err)
     return out, err
-
-
@@ -0,0 +1,277 @@
+import re, math, logging, socket, threading, time
+from six import text_type
+import ipaddress
+
+from dku_kube.busybox_pod import BusyboxPod
+
+# GKE puts this label on all nodes, with the name of their node pool
+NODE_POOL_LABEL = "cloud.google.com/gke-nodepool"
+# taint effects, as named by the GKE API and by Kubernetes
+TAINT_EFFECTS = {"NO_SCHEDULE": "NoSchedule", "PREFER_NO_SCHEDULE": "PreferNoSchedule", "NO_EXECUTE": "NoExecute"}
+
+# runs in the busybox pod, printing one '<rc> <start ns> <end ns>' line per connection attempt (the arithmetic is
+# done on the DSS side, so that a date without nanoseconds doesn't break the shell)
+TCP_CONNECT_SCRIPT = """i=0
+while [ $i -lt %(attempts)s ]; do
+  s=$(date +%%s%%N); nc -z -w %(timeout)s %(ip)s %(port)s >/dev/null 2>&1; rc=$?; e=$(date +%%s%%N)
+  echo "$rc $s $e"
+  i=$((i + 1))
+done"""
+# pushes the payload to the receiver (the pool name and payload size first) and prints what the receiver
+# measured. busybox nc doesn't half-close the connection when stdin ends, it exits when the receiver closes
+THROUGHPUT_SCRIPT = """s=$(date +%%s%%N)
+(echo "POOL %(pool)s %(bytes)s"; dd if=/dev/zero bs=1048576 count=%(count)s 2>/dev/null) | nc -w %(idle_timeout)s %(ip)s %(port)s; rc=$?
+e=$(date +%%s%%N)
+echo "TIMING $rc $s $e"
+exit $rc"""
+DNS_SCRIPT = """s=$(date +%%s%%N); nslookup %(host)s; rc=$?; e=$(date +%%s%%N)
+echo "TIMING $rc $s $e"
+exit $rc"""
+
+
+def get_pod_placement(node_pool_info):
+    """
+    The nodeSelector and tolerations to put a pod on the nodes of a node pool
+    """
+    node_selector = {NODE_POOL_LABEL: node_pool_info["name"]}
+    tolerations = []
+    for taint in node_pool_info.get("config", {}).get("taints", []):
+        tolerations.append({"key": taint["key"], "operator": "Equal", "value": taint.get("value", ""),
+                            "effect": TAINT_EFFECTS.get(taint["effect"], taint["effect"])})
+    if len(node_pool_info.get("config", {}).get("accelerators", [])) > 0:
+        # GKE taints GPU nodes by itself
+        tolerations.append({"key": "nvidia.com/gpu", "operator": "Exists", "effect": "NoSchedule"})
+    return node_selector, tolerations
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile, None if no values
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def _parse_timing(line):
+    """
+    (return code, duration in ms) from a '<rc> <start ns> <end ns>' line. The duration is None if date
+    doesn't support nanoseconds, both are None if the line isn't a timing
+    """
+    chunks = line.split()
+    if len(chunks) < 3:
+        return None, None
+    try:
+        rc = int(chunks[-3])
+    except ValueError:
+        return None, None
+    try:
+        return rc, (int(chunks[-1]) - int(chunks[-2])) / 1000000.0
+    except ValueError:
+        return rc, None
+
+
+def resolve_in_pod(pod, host):
+    """
+    Resolve host from the pod, returns (ip, resolution time in ms, nslookup output)
+    """
+    try:
+        return text_type(ipaddress.ip_address(text_type(host))), None, ''
+    except ValueError:
+        pass
+    out, err = pod.exec_cmd(['sh', '-c', DNS_SCRIPT % {"host": host}], timeout=15)
+    ip, dns_ms = None, None
+    for line in out.split('\n'):
+        m = re.match('^Address.*\\s([0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+[^\\s]*)\\s.*$', line)
+        if m is not None:
+            ip = m.group(1)
+        if line.startswith("TIMING"):
+            rc, dns_ms = _parse_timing(line)
+    return ip, dns_ms, out
+
+
+def measure_tcp_connect(pod, ip, port, attempts, connect_timeout=5):
+    """
+    Open attempts TCP connections from the pod, returns the successful connection times in ms and the number of failures
+    """
+    script = TCP_CONNECT_SCRIPT % {"attempts": attempts, "timeout": connect_timeout, "ip": ip, "port": port}
+    out, err = pod.exec_cmd(['sh', '-c', script], timeout=10 + attempts * (connect_timeout + 1))
+    latencies, failures = [], 0
+    for line in out.strip().split('\n'):
+        rc, duration = _parse_timing(line)
+        if rc is None and duration is None:
+            continue
+        if rc == 0:
+            if duration is not None:
+                latencies.append(duration)
+        else:
+            failures += 1
+    return latencies, failures
+
+
+def benchmark_node_pool(kube_config_path, node_pool_info, host, port, attempts, start_timeout):
+    """
+    Start a probe pod on the node pool and measure DNS resolution and TCP connection times from it
+    """
+    node_selector, tolerations = get_pod_placement(node_pool_info)
+    with BusyboxPod(kube_config_path, start_timeout=start_timeout, node_selector=node_selector, tolerations=tolerations) as pod:
+        ip, dns_ms, dns_out = resolve_in_pod(pod, host)
+        if ip is None:
+            raise Exception('Hostname resolution of DSS node failed: %s' % dns_out)
+        latencies, failures = measure_tcp_connect(pod, ip, port, attempts)
+        return {
+            "nodePool": node_pool_info["name"],
+            "node": pod.node_name,
+            "ip": ip,
+            "dnsMs": dns_ms,
+            "attempts": attempts,
+            "failures": failures,
+            "failureRate": float(failures) / attempts if attempts > 0 else None,
+            "connectMs": {
+                "min": min(latencies) if len(latencies) > 0 else None,
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies) if len(latencies) > 0 else None
+            }
+        }
+
+
+class ThroughputReceiver(object):
+    """
+    Short-lived TCP server on the DSS host, receiving the payloads pushed by the probe pods. A payload
+    is a 'POOL <name> <size in bytes>' line followed by that many bytes; the receiver times them from
+    the first to the last byte (not until the connection ends, since nc may keep it open), answers with
+    what it measured and closes. Connections without a header (like nc -z probes) are ignored. Pods have to take transfer_lock, so that they don't share the bandwidth.
+    """
+    def __init__(self, port=0, read_timeout=30):
+        self.port = port
+        self.read_timeout = read_timeout
+        self.measures = {}
+        self.lock = threading.Lock()
+        self.transfer_lock = threading.Lock()
+        self.stopped = False
+        self.server = None
+        self.thread = None
+
+    def __enter__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('', self.port))
+        self.server.listen(64)
+        # closing the socket doesn't interrupt accept() everywhere, so check for the stop regularly
+        self.server.settimeout(0.5)
+        self.port = self.server.getsockname()[1]
+        logging.info("Throughput receiver listening on port %s" % self.port)
+        self.thread = threading.Thread(target=self._accept_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped = True
+        self.thread.join(5)
+        self.server.close()
+        logging.info("Throughput receiver on port %s stopped" % self.port)
+        return False
+
+    def _accept_loop(self):
+        while not self.stopped:
+            try:
+                conn, addr = self.server.accept()
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if not self.stopped:
+                    logging.error("Throughput receiver failed to accept : %s" % str(e))
+                break
+            t = threading.Thread(target=self._handle, args=(conn, addr, time.time()))
+            t.daemon = True
+            t.start()
+
+    def _handle(self, conn, addr, accepted):
+        try:
+            conn.settimeout(self.read_timeout)
+            buf = b''
+            while b'\n' not in buf:
+                chunk = conn.recv(65536)
+                if not chunk or len(buf) > 1024:
+                    return
+                buf += chunk
+            header, rest = buf.split(b'\n', 1)
+            header = header.decode('utf-8', 'replace').strip()
+            if not header.startswith('POOL '):
+                return
+            chunks = header[len('POOL '):].split()
+            node_pool = chunks[0]
+            expected = int(chunks[1]) if len(chunks) > 1 else None
+            header_received = time.time()
+            received = len(rest)
+            first_byte = header_received if received > 0 else None
+            last_byte = first_byte
+            while expected is None or received < expected:
+                chunk = conn.recv(1024 * 1024)
+                if not chunk:
+                    break
+                last_byte = time.time()
+                if first_byte is None:
+                    first_byte = last_byte
+                received += len(chunk)
+            duration = last_byte - first_byte if first_byte is not None else 0.0
+            measure = {
+                "source": addr[0],
+                "bytes": received,
+                "durationSeconds": duration,
+                "mbPerSecond": received / (1024.0 * 1024.0) / duration if duration > 0 else None,
+                "headerDelayMs": (header_received - accepted) * 1000.0
+            }
+            logging.info("Received %s bytes from %s (%s) in %.3fs" % (received, node_pool, addr[0], duration))
+            with self.lock:
+                self.measures[node_pool] = measure
+            conn.sendall(("RECEIVED %s %.3f\n" % (received, duration)).encode('utf-8'))
+        except Exception as e:
+            logging.warning("Throughput receiver failed on connection from %s : %s" % (addr[0], str(e)))
+        finally:
+            conn.close()
+
+    def get_measure(self, node_pool):
+        with self.lock:
+            return self.measures.get(node_pool, None)
+
+
+def benchmark_node_pool_throughput(kube_config_path, node_pool_info, host, receiver, payload_mb, start_timeout, connect_attempts=3):
+    """
+    Start a probe pod on the node pool, time the connection to the receiver and push payload_mb MB to it
+    """
+    node_pool = node_pool_info["name"]
+    node_selector, tolerations = get_pod_placement(node_pool_info)
+    with BusyboxPod(kube_config_path, start_timeout=start_timeout, node_selector=node_selector, tolerations=tolerations) as pod:
+        ip, dns_ms, dns_out = resolve_in_pod(pod, host)
+        if ip is None:
+            raise Exception('Hostname resolution of DSS node failed: %s' % dns_out)
+        latencies, failures = measure_tcp_connect(pod, ip, receiver.port, connect_attempts)
+        if len(latencies) == 0:
+            raise Exception('Could not connect to %s:%s from the pod (is the port open in the firewall?)' % (ip, receiver.port))
+        # assumes at least 1MB/s
+        script = THROUGHPUT_SCRIPT % {"pool": node_pool, "bytes": payload_mb * 1024 * 1024, "count": payload_mb, "idle_timeout": 10, "ip": ip, "port": receiver.port}
+        with receiver.transfer_lock:
+            out, err = pod.exec_cmd(['sh', '-c', script], timeout=30 + payload_mb)
+        pod_seconds = None
+        for line in out.split('\n'):
+            if line.startswith("TIMING"):
+                rc, duration = _parse_timing(line)
+                pod_seconds = duration / 1000.0 if duration is not None else None
+        measure = receiver.get_measure(node_pool)
+        if measure is None:
+            raise Exception('The receiver got nothing from the pod: %s %s' % (out, err))
+        return {
+            "nodePool": node_pool,
+            "node": pod.node_name,
+            "ip": ip,
+            "connectMs": percentile(latencies, 50),
+            "bytes": measure["bytes"],
+            "complete": measure["bytes"] >= payload_mb * 1024 * 1024,
+            "mbPerSecond": measure["mbPerSecond"],
+            "podSeconds": pod_seconds
+        }
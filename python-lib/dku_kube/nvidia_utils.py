@@ -1,49 +1,139 @@
 import os
+import time
 import logging
-import subprocess
+import yaml
 from dku_utils.access import _is_none_or_blank
-from dku_utils.static_resources import download_to_disk, get_static_resource_path
-from dku_kube.kubectl_command import run_with_timeout
+from dku_utils.static_resources import get_cached_download, get_static_resource_path
+from dku_kube.api_client import get_kube_api_client, _parse_timestamp
 
 DAEMONSET_MANIFEST_URL = "https://raw.githubusercontent.com/GoogleCloudPlatform/container-engine-accelerators/master/nvidia-driver-installer/cos/daemonset-preloaded.yaml"
+# value of the gpuDriverInstallation param of node pools when the drivers come from the installer daemonset
+DAEMONSET_DRIVER_INSTALLATION = "DAEMONSET"
+GPU_NODE_LABEL = "cloud.google.com/gke-accelerator"
+GPU_RESOURCE = "nvidia.com/gpu"
+# installing the drivers takes a few minutes per node
+GPU_NODES_READY_TIMEOUT = 15 * 60
+GPU_NODES_POLL_INTERVAL = 10
+
+def get_gke_gpu_driver_version(node_pool_config):
+    """
+    Version of the drivers GKE installs on the nodes of the pool, None if they come from the installer daemonset
+    """
+    driver_installation = node_pool_config.get('gpuDriverInstallation', None)
+    if not node_pool_config.get('withGpu', False) or _is_none_or_blank(driver_installation) or driver_installation == DAEMONSET_DRIVER_INSTALLATION:
+        return None
+    return driver_installation
 
 def has_installer_daemonset(kube_config_path=None):
-    env = os.environ.copy()
-    if not _is_none_or_blank(kube_config_path):
-        logging.debug("Setting kube_config path from KUBECONFIG env variable...")
-        env["KUBECONFIG"] = kube_config_path
-        logging.info("Found KUBECONFIG={}".format(env["KUBECONFIG"]))
+    logging.info("Checking if NVIDIA GPU driver installer is present on the cluster")
+    client = get_kube_api_client(kube_config_path)
+    return client.get("DaemonSet", "nvidia-driver-installer", namespace="kube-system") is not None
 
-    cmd = ["kubectl", "get", "daemonset", "nvidia-driver-installer", "-n", "kube-system", "--ignore-not-found"]
-    logging.info("Checking if NVIDIA GPU driver installer is present on the cluster with : %s" % " ".join(cmd))
-    out, err = run_with_timeout(cmd, env=env, timeout=5)
-    return len(out.strip()) > 0
+def get_installer_daemonset_manifest(use_bundled=False):
+    """
+    The manifest of the driver installer daemonset, from the (cached) upstream URL, or the copy bundled
+    with the plugin if use_bundled or if upstream isn't reachable
+    """
+    if not use_bundled:
+        manifest = get_cached_download(DAEMONSET_MANIFEST_URL, 'manifests')
+        if manifest is not None:
+            return manifest
+        logging.warning("Unable to retrieve daemonset from '%s', using bundled definition instead." % DAEMONSET_MANIFEST_URL)
+    daemonset_path = get_static_resource_path("daemonset-preloaded.yaml")
+    if not os.path.exists(daemonset_path):
+        logging.error("No bundled daemonset definition found at '%s'. GPU driver must be installed manually." % daemonset_path)
+        return None
+    logging.info("Using bundled daemonset definition %s" % daemonset_path)
+    with open(daemonset_path, "r") as f:
+        return f.read()
 
-def create_installer_daemonset_if_needed(kube_config_path=None):
+def create_installer_daemonset_if_needed(kube_config_path=None, use_bundled_manifest=False):
     """
     Launch a pod on each node that will install the NVIDIA drivers.
     """
-    env = os.environ.copy()
     if not has_installer_daemonset(kube_config_path):
         logging.info("Daemonset is not installed on the cluster. Installing.")
 
-        if not _is_none_or_blank(kube_config_path):
-            logging.debug("Setting kube_config path from KUBECONFIG env variable...")
-            env["KUBECONFIG"] = kube_config_path
-            logging.info("Found KUBECONFIG={}".format(env["KUBECONFIG"]))
-
         logging.info("Creating NVIDIA driver daemonset (only GPU-tainted nodes will be affected)")
-        daemonset_path = download_to_disk(DAEMONSET_MANIFEST_URL, download_location="daemonset-preloaded.yaml")
-
-        if not daemonset_path:
-            logging.warning("Unable to retrieve daemonset from '%s', using bundled definition instead." % DAEMONSET_MANIFEST_URL)
-            daemonset_path = get_static_resource_path("daemonset-preloaded.yaml")
-            if not os.path.exists(daemonset_path):
-                logging.error("No bundled daemonset definition found at '%s'. GPU driver must be installed manually." % daemonset_path)
-                return
-
-        cmd = ["kubectl", "apply", "-f", daemonset_path]
-        logging.info("Running command to install NVIDIA driver installer: %s", " ".join(cmd))
-        run_with_timeout(cmd, env=env, timeout=5)
+        manifest = get_installer_daemonset_manifest(use_bundled_manifest)
+        if manifest is None:
+            return
+
+        daemonset = yaml.safe_load(manifest)
+        logging.info("Installing NVIDIA driver installer")
+        get_kube_api_client(kube_config_path).apply(daemonset)
     else:
-        logging.info("NVIDIA driver daemonset already present on the cluster. Skipping.")
\ No newline at end of file
+        logging.info("NVIDIA driver daemonset already present on the cluster. Skipping.")
+
+def _get_allocatable_gpus(node):
+    try:
+        return int(node.get('status', {}).get('allocatable', {}).get(GPU_RESOURCE, '0'))
+    except ValueError:
+        return 0
+
+def get_expected_gpu_nodes(node_pool_infos):
+    """
+    Number of GPU nodes each pool should get, from the node pool definitions returned by GKE: the
+    initial node count is per zone, so it's multiplied by the number of zones of the pool
+    """
+    expected = {}
+    for node_pool_info in node_pool_infos:
+        if len(node_pool_info.get('config', {}).get('accelerators', [])) == 0:
+            continue
+        locations = node_pool_info.get('locations', [])
+        expected[node_pool_info.get('name')] = node_pool_info.get('initialNodeCount', 0) * max(1, len(locations))
+    return expected
+
+def wait_for_gpu_nodes_ready(kube_config_path=None, expected_nodes=None, timeout=GPU_NODES_READY_TIMEOUT):
+    """
+    Wait until the GPU nodes of the given node pools have allocatable GPUs, i.e. until their drivers are
+    installed and the device plugin reports the GPUs. expected_nodes maps the pool names to the number of
+    nodes to wait for, since nodes only show up in the cluster once they're registered; other nodes that
+    show up while waiting are waited for too, and those that go away before being ready (preempted, scaled
+    down, recreated) aren't. Doesn't fail on timeout, but returns what was observed, per node: its pool,
+    whether it's ready, whether it went away, and how long after its creation it was seen ready.
+    """
+    if expected_nodes is None or len(expected_nodes) == 0:
+        logging.info("No GPU node expected")
+        return {}
+    client = get_kube_api_client(kube_config_path)
+    label_selector = GPU_NODE_LABEL + ",cloud.google.com/gke-nodepool in (%s)" % ','.join(sorted(expected_nodes.keys()))
+    start = time.time()
+    report = {}
+    while True:
+        now = time.time()
+        listed = set()
+        for node in client.list("Node", label_selector=label_selector).get('items', []):
+            metadata = node.get('metadata', {})
+            name = metadata.get('name')
+            listed.add(name)
+            if name not in report:
+                report[name] = {'nodePool': metadata.get('labels', {}).get('cloud.google.com/gke-nodepool', None),
+                                'ready': False, 'gone': False, 'driverLatencySeconds': None}
+            report[name]['gone'] = False
+            if not report[name]['ready'] and _get_allocatable_gpus(node) > 0:
+                created = _parse_timestamp(metadata.get('creationTimestamp', None))
+                report[name]['ready'] = True
+                report[name]['driverLatencySeconds'] = now - created if created is not None else None
+                logging.info("GPUs of node %s allocatable %s after its creation" % (name, "%.0fs" % report[name]['driverLatencySeconds'] if created is not None else "(unknown)"))
+        for name in report:
+            if name not in listed and not report[name]['ready'] and not report[name]['gone']:
+                logging.info("Node %s went away before its GPUs were allocatable" % name)
+                report[name]['gone'] = True
+        pending = [name for name in report if not report[name]['ready'] and not report[name]['gone']]
+        missing = {}
+        for node_pool_name, count in expected_nodes.items():
+            seen = len([name for name in report if report[name]['nodePool'] == node_pool_name and (report[name]['ready'] or not report[name]['gone'])])
+            if seen < count:
+                missing[node_pool_name] = count - seen
+        if len(pending) == 0 and len(missing) == 0:
+            logging.info("All %s GPU nodes ready after %.0fs" % (len(report), time.time() - start))
+            return report
+        if time.time() - start >= timeout:
+            if len(pending) > 0:
+                logging.warning("GPUs of %s nodes still not allocatable after %ss: %s" % (len(pending), timeout, ', '.join(pending)))
+            for node_pool_name in missing:
+                logging.warning("%s GPU nodes of pool %s still not registered after %ss" % (missing[node_pool_name], node_pool_name, timeout))
+            return report
+        logging.info("Waiting for the GPUs of %s nodes and for %s nodes to register" % (len(pending), sum(missing.values())))
+        time.sleep(min(GPU_NODES_POLL_INTERVAL, max(0, start + timeout - time.time())))
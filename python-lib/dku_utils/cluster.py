@@ -1,11 +1,16 @@
 from dku_utils.access import _default_if_blank, _default_if_property_blank
 import dataiku
 import yaml
-from dku_google.auth import get_credentials_from_json_or_file
-from dku_google.clusters import Clusters
+from dku_google.clusters_pool import CLUSTERS_POOL
 from dataiku.core.intercom import backend_json_call
 from dku_utils.access import _has_not_blank_property
-import json, logging, re
+import json, logging, re, hashlib, threading, time
+
+# resolved config, Clusters and Cluster of DSS clusters, per DSS cluster id
+RESOLVED_CLUSTERS = {}
+RESOLVED_CLUSTERS_LOCK = threading.Lock()
+# the resolved config also depends on presets, whose changes don't show in the cluster's settings
+RESOLVED_CLUSTER_TTL = 5 * 60
 
 def make_overrides(kube_config_path):
     with open(kube_config_path, "r") as f:
@@ -24,26 +29,19 @@ def make_overrides(kube_config_path):
     return {'spark':spark_settings, 'container':container_settings}
 
 def get_cluster_from_connection_info(config_connection_info, plugin_config_connection_info):
-    credentials = None
+    credentials_data = None
     if _has_not_blank_property(plugin_config_connection_info, 'credentials'):
-        credentials = get_credentials_from_json_or_file(plugin_config_connection_info['credentials'])
-    return Clusters(config_connection_info.get("projectId", None), config_connection_info.get("zone", None), config_connection_info.get("region", None), credentials)
-
-def get_cluster_from_dss_cluster(dss_cluster_id):
-    # get the public API client
-    client = dataiku.api_client()
+        credentials_data = plugin_config_connection_info['credentials']
+    return CLUSTERS_POOL.get(config_connection_info.get("projectId", None), config_connection_info.get("zone", None), config_connection_info.get("region", None), credentials_data,
+                             config_connection_info.get("useGcloudCredentials", False))
 
-    # get the cluster object in DSS
-    found = False
-    for c in client.list_clusters():
-        if c['name'] == dss_cluster_id:
-            found = True
-    if not found:
-        raise Exception("DSS cluster %s doesn't exist" % dss_cluster_id)
-    dss_cluster = client.get_cluster(dss_cluster_id)
+def _get_resolution_key(dss_cluster_settings, cluster_def):
+    # what the resolution depends on: the cluster's params, and the GKE cluster it's currently attached to
+    raw = dss_cluster_settings.get_raw()
+    data = [raw.get('type', None), raw.get('params', {}), cluster_def.get('name', None), cluster_def.get('selfLink', None)]
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
 
-    # get the settings in it
-    dss_cluster_settings = dss_cluster.get_settings()
+def _resolve_dss_cluster(dss_cluster_settings, cluster_def):
     dss_cluster_config = dss_cluster_settings.get_raw()['params']['config']
     # resolve since we get the config with the raw preset setup
     dss_cluster_config = backend_json_call('plugins/get-resolved-settings', data={'elementConfig':json.dumps(dss_cluster_config), 'elementType':dss_cluster_settings.get_raw()['type']})
@@ -51,15 +49,7 @@ def get_cluster_from_dss_cluster(dss_cluster_id):
     # build the helper class from the cluster settings (the macro doesn't have the params)
     clusters = get_cluster_from_connection_info(dss_cluster_config['config']['connectionInfo'], dss_cluster_config['pluginConfig']['connectionInfo'])
 
-    cluster_data = dss_cluster_settings.get_plugin_data()
-    
-    if cluster_data is None:
-        raise Exception("No cluster data (not started?)")
-    cluster_def = cluster_data.get("cluster", None)
-    if cluster_def is None:
-        raise Exception("No cluster definition (starting failed?)")
     cluster_name = cluster_def["name"]
-
     self_link = cluster_def.get('selfLink', None)
     if self_link is None:
         raise Exception("No selflink found, cluster is probably not running")
@@ -67,8 +57,40 @@ def get_cluster_from_dss_cluster(dss_cluster_id):
         definition_level = 'zonal'
     else:
         definition_level = 'regional'
-        
+
     cluster = clusters.get_cluster(cluster_name, definition_level)
+    return dss_cluster_config, cluster
 
-    return cluster_data, cluster, dss_cluster_settings, dss_cluster_config
+def get_cluster_from_dss_cluster(dss_cluster_id):
+    # get the public API client
+    client = dataiku.api_client()
+
+    # get the cluster object in DSS, and the settings in it
+    dss_cluster = client.get_cluster(dss_cluster_id)
+    try:
+        dss_cluster_settings = dss_cluster.get_settings()
+    except Exception as e:
+        raise Exception("DSS cluster %s doesn't exist (%s)" % (dss_cluster_id, str(e)))
+
+    cluster_data = dss_cluster_settings.get_plugin_data()
     
+    if cluster_data is None:
+        raise Exception("No cluster data (not started?)")
+    cluster_def = cluster_data.get("cluster", None)
+    if cluster_def is None:
+        raise Exception("No cluster definition (starting failed?)")
+
+    # resolving the settings and building the handles takes backend and API round trips, reuse them
+    # as long as the settings and the GKE cluster don't change
+    key = _get_resolution_key(dss_cluster_settings, cluster_def)
+    with RESOLVED_CLUSTERS_LOCK:
+        cached = RESOLVED_CLUSTERS.get(dss_cluster_id, None)
+    if cached is not None and cached['key'] == key and time.time() - cached['resolved'] < RESOLVED_CLUSTER_TTL:
+        logging.info("Using resolved settings of DSS cluster %s from %.0fs ago" % (dss_cluster_id, time.time() - cached['resolved']))
+        dss_cluster_config, cluster = cached['config'], cached['cluster']
+    else:
+        dss_cluster_config, cluster = _resolve_dss_cluster(dss_cluster_settings, cluster_def)
+        with RESOLVED_CLUSTERS_LOCK:
+            RESOLVED_CLUSTERS[dss_cluster_id] = {'key': key, 'resolved': time.time(), 'config': dss_cluster_config, 'cluster': cluster}
+
+    return cluster_data, cluster, dss_cluster_settings, dss_cluster_config
@@ -0,0 +1,167 @@
+import threading, time, logging
+
+class TaskResult(object):
+    def __init__(self, key):
+        self.key = key
+        self.value = None
+        self.error = None
+        self.timed_out = False
+        self.duration = None
+
+    def is_success(self):
+        return self.error is None
+
+def run_concurrently(tasks, max_workers=8, timeout=None):
+    """
+    Run the tasks, a list of (key, function) pairs, in at most max_workers threads. Each function
+    gets timeout seconds (if not None) to finish, after which it's reported as timed out and not
+    waited for anymore (its thread is left to finish on its own). A failing task doesn't stop the
+    others. Returns one TaskResult per task, in the order of the tasks.
+    """
+    results = [TaskResult(key) for key, f in tasks]
+    pending = list(range(0, len(tasks)))
+    running = {}
+    condition = threading.Condition()
+
+    def run(idx):
+        start = time.time()
+        value, error = None, None
+        try:
+            value = tasks[idx][1]()
+        except Exception as e:
+            logging.exception("Task %s failed" % str(tasks[idx][0]))
+            error = e
+        with condition:
+            if idx in running:
+                results[idx].value = value
+                results[idx].error = error
+                results[idx].duration = time.time() - start
+                del running[idx]
+            condition.notify()
+
+    with condition:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < max_workers:
+                idx = pending.pop(0)
+                running[idx] = time.time()
+                t = threading.Thread(target=run, args=(idx,))
+                t.daemon = True
+                t.start()
+            wait = None
+            if timeout is not None:
+                now = time.time()
+                for idx, start in list(running.items()):
+                    if now - start >= timeout:
+                        logging.warning("Task %s did not finish after %ss" % (str(tasks[idx][0]), timeout))
+                        results[idx].timed_out = True
+                        results[idx].error = Exception("Did not finish after %ss" % timeout)
+                        results[idx].duration = now - start
+                        del running[idx]
+                if len(running) > 0:
+                    wait = max(0, min(running.values()) + timeout - now)
+            if len(running) > 0 and (len(pending) == 0 or len(running) >= max_workers):
+                condition.wait(wait)
+    return results
+
+# per-step timeouts (in seconds) of the cluster start sequences
+HOST_LOOKUP_TIMEOUT = 60
+CLUSTER_INFO_TIMEOUT = 60
+KUBE_SETUP_TIMEOUT = 120
+
+class Step(object):
+    """
+    A step of run_steps(): function gets the dict of the results of the steps done so far, by name
+    """
+    def __init__(self, name, function, depends_on=[], timeout=None):
+        self.name = name
+        self.function = function
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+
+class StepException(Exception):
+    def __init__(self, message, step_name, timings):
+        super(StepException, self).__init__(message)
+        self.step_name = step_name
+        self.timings = timings
+
+def run_steps(steps, max_workers=8):
+    """
+    Run the steps, in at most max_workers threads, each as soon as all the steps it depends on are done.
+    A step taking more than its timeout (if not None) is reported as failed and not waited for anymore.
+    When a step fails, no other step is started, the running ones are waited for, and a StepException
+    is raised. Returns the results of the steps by name, and their timings (start offset and duration,
+    in seconds, in the order the steps were started).
+    """
+    names = set([step.name for step in steps])
+    if len(names) != len(steps):
+        raise ValueError("Step names must be unique")
+    for step in steps:
+        for dependency in step.depends_on:
+            if dependency not in names:
+                raise ValueError("Step %s depends on unknown step %s" % (step.name, dependency))
+
+    start = time.time()
+    results = {}
+    timings = []
+    pending = list(steps)
+    running = {}
+    failure = []
+    condition = threading.Condition()
+
+    def run(step, timing, done_results):
+        value, error = None, None
+        try:
+            value = step.function(done_results)
+        except Exception as e:
+            logging.exception("Step %s failed" % step.name)
+            error = e
+        with condition:
+            if step.name in running:
+                del running[step.name]
+                timing['duration'] = time.time() - start - timing['start']
+                if error is None:
+                    results[step.name] = value
+                    timing['status'] = 'DONE'
+                else:
+                    timing['status'] = 'FAILED'
+                    failure.append((step.name, error))
+            condition.notify()
+
+    with condition:
+        while len(running) > 0 or (len(pending) > 0 and len(failure) == 0):
+            if len(failure) == 0:
+                for step in [s for s in pending if all([d in results for d in s.depends_on])]:
+                    if len(running) >= max_workers:
+                        break
+                    pending.remove(step)
+                    timing = {'name': step.name, 'start': time.time() - start, 'duration': None, 'status': 'RUNNING'}
+                    timings.append(timing)
+                    running[step.name] = (step, timing)
+                    t = threading.Thread(target=run, args=(step, timing, dict(results)))
+                    t.daemon = True
+                    t.start()
+            wait = None
+            now = time.time()
+            for name, (step, timing) in list(running.items()):
+                if step.timeout is None:
+                    continue
+                deadline = start + timing['start'] + step.timeout
+                if now >= deadline:
+                    logging.warning("Step %s did not finish after %ss" % (name, step.timeout))
+                    del running[name]
+                    timing['duration'] = now - start - timing['start']
+                    timing['status'] = 'TIMED_OUT'
+                    failure.append((name, Exception("Step %s did not finish after %ss" % (name, step.timeout))))
+                else:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+            if len(running) == 0 and len(failure) == 0 and len(pending) > 0:
+                # nothing running and nothing can start: unreachable with valid dependencies, unless there's a cycle
+                raise ValueError("Steps %s depend on each other" % ', '.join([s.name for s in pending]))
+            if len(running) > 0:
+                condition.wait(wait)
+
+    logging.info("Steps took %s" % ', '.join(["%s %.2fs" % (t['name'], t['duration']) for t in timings if t['duration'] is not None]))
+    if len(failure) > 0:
+        name, error = failure[0]
+        raise StepException("Step %s failed: %s" % (name, str(error)), name, timings)
+    return results, timings
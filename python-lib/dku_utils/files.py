@@ -0,0 +1,95 @@
+import os, errno, tempfile, time, logging
+from contextlib import contextmanager
+from dku_utils.access import _has_not_blank_property
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PLUGIN_ID = "gke-clusters"
+# how long to wait for a lock file held by another process, and after how long such a file is considered
+# left over by a process that died while holding it
+LOCK_FILE_TIMEOUT = 60
+STALE_LOCK_FILE_AGE = 30
+LOCK_FILE_POLL_INTERVAL = 0.05
+
+def get_plugin_cache_dir(*path):
+    """
+    Folder where the plugin persists what it caches across processes (cluster starts, macros, ...)
+    """
+    if _has_not_blank_property(os.environ, 'DIP_HOME'):
+        root = os.path.join(os.environ['DIP_HOME'], 'caches', 'plugins', PLUGIN_ID)
+    else:
+        root = os.path.join(tempfile.gettempdir(), 'dss-plugin-%s' % PLUGIN_ID)
+    cache_dir = os.path.join(root, *path)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # another process may have created it in the meantime
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+def write_atomically(path, content, mode="w"):
+    """
+    Write to a temporary file next to path, then rename it, so that readers never see a partial file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+@contextmanager
+def file_lock(lock_path, shared=False):
+    """
+    Advisory lock on lock_path (created if needed), shared between readers or exclusive for a writer.
+    Not enforced on platforms without fcntl.
+    """
+    with open(lock_path, "a") as f:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def lock_file(lock_path, timeout=LOCK_FILE_TIMEOUT, stale_age=STALE_LOCK_FILE_AGE):
+    """
+    Lock held by creating lock_path exclusively, and released by removing it. This is what client-go (so
+    kubectl) does with <kube config>.lock, so that the plugin and kubectl don't rewrite a kube config at
+    the same time. Waits at most timeout seconds for the lock, and removes a lock file older than stale_age
+    seconds, since the owners of the lock only hold it for the time of a rewrite.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - os.path.getmtime(lock_path) > stale_age:
+                logging.warning("Removing stale lock file %s" % lock_path)
+                os.remove(lock_path)
+                continue
+        except OSError:
+            # released in the meantime
+            continue
+        if time.time() > deadline:
+            raise Exception("Timed out waiting for the lock file %s, remove it if no process is using it" % lock_path)
+        time.sleep(LOCK_FILE_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
@@ -0,0 +1,132 @@
+import json
+from dku_utils.access import _merge_objects, _is_none_or_blank, dku_basestring_type
+try:
+    from collections.abc import Mapping # py3
+except ImportError:
+    from collections import Mapping # py2
+
+# a key of the valve can be suffixed with a directive telling how its value is combined with the
+# existing one, like "nodePools$mergeBy:name" or "taints$replace". Without directive, the value is
+# merged like _merge_objects() does: objects are merged recursively, lists are appended to
+DIRECTIVE_SEPARATOR = "$"
+REPLACE = "replace"
+APPEND = "append"
+MERGE_BY = "mergeBy:"
+
+_MISSING = object()
+
+
+def _copy(value):
+    # values of the valve come from JSON, so this is a deep copy, without the overhead of copy.deepcopy()
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_copy(v) for v in value]
+    else:
+        return value
+
+
+class _ValveEntry(object):
+    """
+    How one key of the valve is applied to the corresponding value in the settings
+    """
+    def __init__(self, key, strategy, value, path):
+        self.key = key
+        self.path = path
+        self.strategy = strategy
+        self.value = value
+        self.merge_field = None
+        self.sub_patch = None
+        self.item_patches = None
+        if strategy == REPLACE:
+            pass
+        elif strategy == APPEND:
+            if not isinstance(value, list):
+                raise ValueError("%s: $%s needs a list, got %s" % (path, APPEND, type(value).__name__))
+        elif strategy.startswith(MERGE_BY):
+            self.merge_field = strategy[len(MERGE_BY):]
+            if _is_none_or_blank(self.merge_field):
+                raise ValueError("%s: $%s needs a field name" % (path, MERGE_BY))
+            if not isinstance(value, list):
+                raise ValueError("%s: $%s needs a list, got %s" % (path, strategy, type(value).__name__))
+            self.item_patches = []
+            for i in range(0, len(value)):
+                item = value[i]
+                if not isinstance(item, Mapping) or self.merge_field not in item:
+                    raise ValueError("%s[%s]: items merged by %s must be objects with a %s field" % (path, i, self.merge_field, self.merge_field))
+                self.item_patches.append((item[self.merge_field], SettingsPatch(item, "%s[%s]" % (path, i))))
+        elif strategy == "":
+            if isinstance(value, Mapping):
+                self.sub_patch = SettingsPatch(value, path)
+        else:
+            raise ValueError("%s: unknown directive $%s" % (path, strategy))
+
+    def apply(self, existing):
+        if self.strategy == REPLACE or existing is _MISSING:
+            return _copy(self.value)
+        if self.strategy == APPEND:
+            if not isinstance(existing, list):
+                raise ValueError("%s: can't append to a %s" % (self.path, type(existing).__name__))
+            return existing + _copy(self.value)
+        if self.merge_field is not None:
+            if not isinstance(existing, list):
+                raise ValueError("%s: can't merge into a %s" % (self.path, type(existing).__name__))
+            result = list(existing)
+            positions = {}
+            for i in range(0, len(result)):
+                if isinstance(result[i], Mapping) and self.merge_field in result[i]:
+                    positions[result[i][self.merge_field]] = i
+            for merge_key, item_patch in self.item_patches:
+                if merge_key in positions:
+                    result[positions[merge_key]] = item_patch.apply(result[positions[merge_key]])
+                else:
+                    positions[merge_key] = len(result)
+                    result.append(item_patch.apply({}))
+            return result
+        if self.sub_patch is not None and isinstance(existing, Mapping):
+            return self.sub_patch.apply(existing)
+        if isinstance(self.value, list) and isinstance(existing, list):
+            return existing + _copy(self.value)
+        # same semantics as before for the rest
+        return _merge_objects(existing, _copy(self.value))
+
+
+class SettingsPatch(object):
+    """
+    A settings valve (the JSON object of custom settings), validated and prepared once, that can then be
+    applied to any number of settings objects. Applying it doesn't modify the settings: it returns a copy
+    of the objects along the patched paths, and shares everything else with the original.
+    """
+    def __init__(self, valve, path="valve"):
+        if not isinstance(valve, Mapping):
+            raise ValueError("%s: custom settings must be a JSON object, got %s" % (path, type(valve).__name__))
+        self.entries = []
+        keys = set()
+        for raw_key, value in valve.items():
+            if not isinstance(raw_key, dku_basestring_type):
+                raise ValueError("%s: invalid key %s" % (path, raw_key))
+            key, _, strategy = raw_key.partition(DIRECTIVE_SEPARATOR)
+            if key in keys:
+                raise ValueError("%s: %s is set more than once" % (path, key))
+            keys.add(key)
+            self.entries.append(_ValveEntry(key, strategy, value, "%s.%s" % (path, key)))
+
+    def apply(self, settings):
+        result = dict(settings)
+        for entry in self.entries:
+            result[entry.key] = entry.apply(settings.get(entry.key, _MISSING))
+        return result
+
+
+def compile_settings_valve(settings_valve):
+    """
+    Parse (if it's a string) and validate a settings valve, None if blank. Raises ValueError if it's invalid
+    """
+    if _is_none_or_blank(settings_valve):
+        return None
+    if isinstance(settings_valve, dku_basestring_type):
+        try:
+            settings_valve = json.loads(settings_valve)
+        except ValueError as e:
+            raise ValueError("Custom settings are not valid JSON: %s" % str(e))
+    return SettingsPatch(settings_valve)
@@ -1,32 +1,87 @@
 import logging
 import os
+import json
+import time
+import hashlib
 import requests
 from dku_utils.access import _is_none_or_blank
+from dku_utils.files import get_plugin_cache_dir, write_atomically, file_lock
 
 DEFAULT_HEADERS={"User-Agent": "DSS GKE Plugin"}
+# (connect, read) timeouts when fetching a remote resource, so that a slow or blocked egress doesn't stall the caller
+DOWNLOAD_TIMEOUT = (3, 10)
+# a cached download younger than this is used without asking the server
+CACHED_DOWNLOAD_MAX_AGE = 60 * 60
 
-def download_to_disk(url, download_location=None):
-    if _is_none_or_blank(url):
-        logging.error("URL '%s' is none or blank." % url)
-        return
+def get_static_resource_path(static_resource_filename):
+    return os.path.join(os.environ["DKU_CUSTOM_RESOURCE_FOLDER"], static_resource_filename)
 
-    if _is_none_or_blank(download_location):
-        local_path = url.split('/')[-1]
-    else:
-        local_path = download_location
+def _get_download_cache_index(cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning("Ignoring corrupted download cache index %s" % index_path)
+        return {}
+
+def _read_cached_download(cache_dir, entry):
+    if entry is None:
+        return None
+    blob_path = os.path.join(cache_dir, entry['sha256'])
+    if not os.path.exists(blob_path):
+        return None
+    with open(blob_path, "rb") as f:
+        content = f.read()
+    if hashlib.sha256(content).hexdigest() != entry['sha256']:
+        logging.warning("Cached content of %s is corrupted" % blob_path)
+        return None
+    return content.decode('utf-8')
 
-    r = requests.get(url, headers=DEFAULT_HEADERS)
-    if r.ok:
-        logging.debug("Successfully retrieved content from URL '%s'." % url)
-        logging.debug("Writing contents into path '%s'." % local_path)
-        with open(local_path, "w") as f:
-            f.write(r.text)
+def get_cached_download(url, cache_name, max_age=CACHED_DOWNLOAD_MAX_AGE, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Content of url, from a cache shared by all processes of the plugin. Contents are stored by their sha256,
+    with an index of the url -> (etag, sha256). A cached content older than max_age is revalidated with
+    If-None-Match. If the server can't be reached in time, the cached content is used even if stale.
+    Returns None if there is neither a cached content nor a successful download.
+    """
+    cache_dir = get_plugin_cache_dir(cache_name)
+    lock_path = os.path.join(cache_dir, '.lock')
+    with file_lock(lock_path, shared=True):
+        entry = _get_download_cache_index(cache_dir).get(url, None)
+        cached = _read_cached_download(cache_dir, entry)
+    if cached is not None and time.time() - entry.get('fetched', 0) < max_age:
+        logging.info("Using cached content of %s (%s)" % (url, entry['sha256']))
+        return cached
 
-        return os.path.abspath(local_path)
+    headers = dict(DEFAULT_HEADERS)
+    if cached is not None and not _is_none_or_blank(entry.get('etag', None)):
+        headers['If-None-Match'] = entry['etag']
+    try:
+        r = requests.get(url, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        logging.warning("Unable to retrieve '%s' : %s" % (url, str(e)))
+        return cached
+
+    if r.status_code == 304 and cached is not None:
+        logging.info("Cached content of %s is still current" % url)
+        entry = dict(entry, fetched=time.time())
+        content = cached
+    elif r.ok:
+        content = r.content.decode('utf-8')
+        entry = {'etag': r.headers.get('ETag', None), 'sha256': hashlib.sha256(r.content).hexdigest(), 'fetched': time.time()}
+        logging.info("Retrieved %s (%s)" % (url, entry['sha256']))
     else:
         logging.error("Retrieving the file from URL '%s' failed with status: %s %s" % (url, r.status_code, r.reason))
-        logging.error("Content of failed request: %s" % r.content)
-        logging.error("Unable to retrieve the contents from URL '%s'." % url)
+        return cached
 
-def get_static_resource_path(static_resource_filename):
-    return os.path.join(os.environ["DKU_CUSTOM_RESOURCE_FOLDER"], static_resource_filename)
\ No newline at end of file
+    with file_lock(lock_path):
+        blob_path = os.path.join(cache_dir, entry['sha256'])
+        if not os.path.exists(blob_path):
+            write_atomically(blob_path, content.encode('utf-8'), mode="wb")
+        index = _get_download_cache_index(cache_dir)
+        index[url] = entry
+        write_atomically(os.path.join(cache_dir, 'index.json'), json.dumps(index, indent=2))
+    return content
@@ -1,8 +1,9 @@
 import dataiku
 import json, logging, os
 from dku_google.clusters import Clusters
+from dku_google.operations import NODE_POOL_OPERATION_TIMEOUT, to_dss_progress_callback
 from dku_utils.cluster import get_cluster_from_dss_cluster
-from dku_kube.nvidia_utils import create_installer_daemonset_if_needed
+from dku_kube.nvidia_utils import create_installer_daemonset_if_needed, get_gke_gpu_driver_version, wait_for_gpu_nodes_ready, get_expected_gpu_nodes
 from dataiku.runnables import Runnable
 
 
@@ -14,7 +15,7 @@ class MyRunnable(Runnable):
         self.plugin_config = plugin_config
 
     def get_progress_target(self):
-        return None
+        return (100, 'NONE')
 
     def run(self, progress_callback):
         logging.getLogger().setLevel(self.config.get('logLevel', 'INFO'))
@@ -46,7 +47,8 @@ class MyRunnable(Runnable):
         node_pool_builder.with_disk_size_gb(node_pool_config.get('diskSizeGb', None))
         node_pool_builder.with_gpu(node_pool_config.get('withGpu', False),
                                    node_pool_config.get('gpuType', None),
-                                   node_pool_config.get('gpuCount', 1))
+                                   node_pool_config.get('gpuCount', 1),
+                                   get_gke_gpu_driver_version(node_pool_config))
         node_pool_builder.with_spot_vms(node_pool_config.get('useSpotVms', False))
         node_pool_builder.with_service_account(node_pool_config.get('serviceAccountType', None),
                                                node_pool_config.get('serviceAccount', None))
@@ -57,12 +59,15 @@ class MyRunnable(Runnable):
 
         create_op = node_pool_builder.build()
         logging.info("Waiting for cluster node pool creation")
-        create_op.wait_done()
+        create_op.wait_done(timeout=NODE_POOL_OPERATION_TIMEOUT, progress_callback=to_dss_progress_callback(progress_callback))
         logging.info("Cluster node pool created")
 
         # Launch NVIDIA driver installer daemonset (will only apply on tainted gpu nodes) if it's required.
+        gpu_nodes_readiness = ''
         if node_pool_config.get('withGpu', False): # GPUs are not supported on autopilot (says the GKE doc)
-            create_installer_daemonset_if_needed(kube_config_path=kube_config_path)
+            if get_gke_gpu_driver_version(node_pool_config) is None:
+                create_installer_daemonset_if_needed(kube_config_path=kube_config_path, use_bundled_manifest=dss_cluster_config['config'].get('useBundledGpuDriverManifest', False))
+            readiness = wait_for_gpu_nodes_ready(kube_config_path, get_expected_gpu_nodes([node_pool.get_info()]))
+            gpu_nodes_readiness = '<h5>GPU nodes readiness</h5><pre class="debug">%s</pre>' % json.dumps(readiness, indent=2)
 
-
-        return '<pre class="debug">%s</pre>' % json.dumps(node_pool.get_info(), indent=2)
+        return '<pre class="debug">%s</pre><h5>Operation timings</h5><pre class="debug">%s</pre>%s' % (json.dumps(node_pool.get_info(), indent=2), json.dumps(create_op.get_timings(), indent=2), gpu_nodes_readiness)
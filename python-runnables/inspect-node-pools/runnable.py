@@ -3,6 +3,10 @@ import dataiku
 import json, logging
 from dku_google.clusters import Clusters
 from dku_utils.cluster import get_cluster_from_dss_cluster
+from dku_utils.concurrency import run_concurrently
+
+MAX_CONCURRENT_INSPECTIONS = 8
+INSPECTION_TIMEOUT = 60
 
 class MyRunnable(Runnable):
     def __init__(self, project_key, config, plugin_config):
@@ -22,17 +26,35 @@ class MyRunnable(Runnable):
         node_pool_id = self.config.get('nodePoolId', None)
         if node_pool_id is None or len(node_pool_id) == 0:
             node_pools = cluster.get_node_pools() # CRASHES HERE
-            node_pool_ids = [node_pool.name for node_pool in node_pools]
         else:
-            node_pool_ids = [node_pool_id]
+            node_pools = [cluster.get_node_pool(node_pool_id)]
+
+        def inspect(node_pool, instance_groups):
+            http = None
+            if instance_groups is None:
+                # calls from a worker thread need their own transport
+                http = cluster.clusters.get_http()
+                instance_groups = cluster.get_instance_groups_info([node_pool], http)[0]
+            node_pool_info = dict(node_pool.get_info(http=http))
+            node_pool_info["instanceGroups"] = instance_groups
+            return node_pool_info
+
+        # the instance groups of all pools in one batch, with the bounded timeout of get_http(). If that fails,
+        # each pool is inspected on its own, so that one pool failing or being slow doesn't prevent reporting on the others
+        try:
+            all_instance_groups = cluster.get_instance_groups_info(node_pools, cluster.clusters.get_http())
+        except Exception as e:
+            logging.warning("Failed to get the instance groups of all node pools at once, inspecting them one by one : %s" % str(e))
+            all_instance_groups = [None for node_pool in node_pools]
+        results = run_concurrently([(node_pool.name, lambda node_pool=node_pool, instance_groups=instance_groups: inspect(node_pool, instance_groups))
+                                    for node_pool, instance_groups in zip(node_pools, all_instance_groups)],
+                                   max_workers=MAX_CONCURRENT_INSPECTIONS, timeout=INSPECTION_TIMEOUT)
 
-        node_pools = []
-        for node_pool_id in node_pool_ids:
-            node_pool = cluster.get_node_pool(node_pool_id)
-            
-            node_pool_info = node_pool.get_info()
-            node_pool_info["instanceGroups"] = node_pool.get_instance_groups_info()
-            
-            node_pools.append('<h5>%s</h5><pre class="debug">%s</pre>' % (node_pool_id, json.dumps(node_pool_info, indent=2)))
+        node_pools_info = []
+        for result in results:
+            if result.is_success():
+                node_pools_info.append('<h5>%s</h5><pre class="debug">%s</pre>' % (result.key, json.dumps(result.value, indent=2)))
+            else:
+                node_pools_info.append('<h5>%s</h5><div class="alert alert-error">Failed to inspect node pool : %s</div>' % (result.key, str(result.error)))
         
-        return '<div>%s</div>' % ''.join(node_pools)
\ No newline at end of file
+        return '<div>%s</div>' % ''.join(node_pools_info)
\ No newline at end of file
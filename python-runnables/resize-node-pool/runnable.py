@@ -2,6 +2,7 @@ from dataiku.runnables import Runnable
 import dataiku
 import json, logging
 from dku_google.clusters import Clusters
+from dku_google.operations import OperationGroup, NODE_POOL_OPERATION_TIMEOUT, to_dss_progress_callback
 from dku_utils.cluster import get_cluster_from_dss_cluster
 
 class MyRunnable(Runnable):
@@ -11,7 +12,7 @@ class MyRunnable(Runnable):
         self.plugin_config = plugin_config
         
     def get_progress_target(self):
-        return None
+        return (100, 'NONE')
 
     def run(self, progress_callback):
         cluster_data, cluster, dss_cluster_settings, dss_cluster_config = get_cluster_from_dss_cluster(self.config['clusterId'])
@@ -19,28 +20,49 @@ class MyRunnable(Runnable):
         if cluster_data.get("cluster", {}).get("autopilot", {}).get("enabled", False):
             raise Exception("Nodepools aren't accessible on autopilot clusters")
         
-        node_pool_id = self.config.get('nodePoolId', None)
+        # one or several (comma-separated) node pools, resized or deleted side by side
+        node_pool_ids = [node_pool_id.strip() for node_pool_id in (self.config.get('nodePoolId', None) or '').split(',') if len(node_pool_id.strip()) > 0]
         node_pools = cluster.get_node_pools()
-        if node_pool_id is None or len(node_pool_id) == 0:
+        if len(node_pool_ids) == 0:
             node_pool_ids = [node_pool.name for node_pool in node_pools]
             if len(node_pool_ids) != 1:
                 raise Exception("Cluster has %s node pools, cannot resize. Specify a node pool explicitely among %s" % (len(node_pool_ids), json.dumps(node_pool_ids)))
-            node_pool_id = node_pool_ids[0]
-        
-        node_pool = cluster.get_node_pool(node_pool_id)
         
         desired_count = self.config['numNodes']
-        logging.info("Resize to %s" % desired_count)
+        logging.info("Resize %s to %s" % (', '.join(node_pool_ids), desired_count))
+        operations = OperationGroup()
+        node_pool_operations = {}
+        errors = {}
+        for node_pool_id in node_pool_ids:
+            node_pool = cluster.get_node_pool(node_pool_id, node_pools)
+            try:
+                if desired_count == 0:
+                    operation = node_pool.delete()
+                else:
+                    operation = node_pool.resize(desired_count)
+                node_pool_operations[node_pool_id] = (node_pool, operations.add(operation))
+            except Exception as e:
+                logging.error("Failed to resize node pool %s : %s" % (node_pool_id, str(e)))
+                errors[node_pool_id] = str(e)
+        logging.info("Waiting for %s node pool operations" % len(node_pool_operations))
+        operations.wait_done(timeout=NODE_POOL_OPERATION_TIMEOUT, progress_callback=to_dss_progress_callback(progress_callback))
+        logging.info("Node pool operations done")
+
+        results = []
+        for node_pool_id in node_pool_ids:
+            if node_pool_id in errors:
+                results.append('<h5>%s</h5><div class="alert alert-error">%s</div>' % (node_pool_id, errors[node_pool_id]))
+                continue
+            node_pool, operation = node_pool_operations[node_pool_id]
+            error = operation.operation.get('error', {}).get('message', None) or operation.operation.get('statusMessage', None)
+            if error:
+                results.append('<h5>%s</h5><div class="alert alert-error">%s</div>' % (node_pool_id, error))
+            elif desired_count == 0:
+                results.append('<h5>%s</h5><div>Deleted</div>' % node_pool_id)
+            else:
+                results.append('<h5>%s</h5><pre class="debug">%s</pre>' % (node_pool_id, json.dumps(node_pool.get_info(), indent=2)))
+            results.append('<h5>Operation timings</h5><pre class="debug">%s</pre>' % json.dumps(operation.get_timings(), indent=2))
         if desired_count == 0:
-            delete_op = node_pool.delete()
-            logging.info("Waiting for cluster node pool delete")
-            delete_op.wait_done()
-            logging.info("Cluster node pool deleted")
             node_pool_ids = [node_pool.name for node_pool in cluster.get_node_pools()]
-            return '<pre class="debug">%s</pre>' % json.dumps(node_pool_ids, indent=2)
-        else:
-            resize_op = node_pool.resize(self.config['numNodes'])
-            logging.info("Waiting for cluster resize")
-            resize_op.wait_done()
-            logging.info("Cluster resized")
-            return '<pre class="debug">%s</pre>' % json.dumps(node_pool.get_info(), indent=2)
\ No newline at end of file
+            results.append('<h5>Remaining node pools</h5><pre class="debug">%s</pre>' % json.dumps(node_pool_ids, indent=2))
+        return ''.join(results)
@@ -3,7 +3,11 @@ import os, sys, json, yaml, random, subprocess, socket, re, traceback, ipaddress
 from six import text_type
 from dku_kube.busybox_pod import BusyboxPod
 from dku_kube.kubectl_command import KubeCommandException
+from dku_kube.network_benchmark import benchmark_node_pool, benchmark_node_pool_throughput, ThroughputReceiver
 from dku_utils.cluster import get_cluster_from_dss_cluster
+from dku_utils.concurrency import run_concurrently
+
+MAX_CONCURRENT_PROBES = 8
 
 class MyRunnable(Runnable):
 
@@ -16,7 +20,7 @@ class MyRunnable(Runnable):
         return None
 
     def run(self, progress_callback):
-        cluster_data, _, dss_cluster_settings, _ = get_cluster_from_dss_cluster(self.config['clusterId'])
+        cluster_data, cluster, dss_cluster_settings, _ = get_cluster_from_dss_cluster(self.config['clusterId'])
 
         # the cluster is accessible via the kubeconfig
         kube_config_path = dss_cluster_settings.get_raw()['containerSettings']['executionConfigsGenericOverrides']['kubeConfigPath']
@@ -32,6 +36,11 @@ class MyRunnable(Runnable):
         
         host = os.environ.get('DKU_BACKEND_EXT_HOST', socket.gethostname())
         port = os.environ['DKU_BACKEND_PORT']
+        if self.config.get('mode', 'connectivity') == 'benchmark':
+            return self._run_benchmark(cluster, cluster_def, kube_config_path, host, port)
+        if self.config.get('mode', 'connectivity') == 'throughput':
+            return self._run_throughput(cluster, cluster_def, kube_config_path, host)
+
         result = result + '<h5>Checking connectivity to %s:%s from pod in cluster</h5>' % (host, port)
         
         def add_to_result(result, op, cmd, out, err):
@@ -41,7 +50,7 @@ class MyRunnable(Runnable):
             # sanity check
             if host.startswith("127.0.0") or 'localhost' in host:
                 raise Exception('Host appears to not be a public hostname. Set DKU_BACKEND_EXT_HOST')
-            with BusyboxPod(kube_config_path) as b:
+            with BusyboxPod(kube_config_path, start_timeout=self.config.get('podStartTimeout', 60)) as b:
                 try:
                     ip = text_type(ipaddress.ip_address(host))
                     result = result + '<h5>Host %s is an ip. No need to resolve it, testing connection directly</h5>' % (host)
@@ -78,3 +87,72 @@ class MyRunnable(Runnable):
             result = result + '<div class="alert alert-error">%s</div>' % str(e)
                 
         return '<div>%s</div>' % result
+
+    def _get_node_pools(self, cluster, cluster_def, host):
+        if cluster_def.get("autopilot", {}).get("enabled", False):
+            raise Exception("Nodepools aren't accessible on autopilot clusters")
+        if host.startswith("127.0.0") or 'localhost' in host:
+            raise Exception('Host appears to not be a public hostname. Set DKU_BACKEND_EXT_HOST')
+        node_pool_id = self.config.get('nodePoolId', None)
+        if node_pool_id is None or len(node_pool_id) == 0:
+            return cluster.get_node_pools()
+        else:
+            return [cluster.get_node_pool(node_pool_id)]
+
+    @staticmethod
+    def _fmt(value):
+        return '-' if value is None else '%.1f' % value
+
+    def _run_benchmark(self, cluster, cluster_def, kube_config_path, host, port):
+        node_pools = self._get_node_pools(cluster, cluster_def, host)
+        attempts = self.config.get('connectionAttempts', 20)
+        start_timeout = self.config.get('podStartTimeout', 60)
+
+        def probe(node_pool_info):
+            return benchmark_node_pool(kube_config_path, node_pool_info, host, port, attempts, start_timeout)
+        # each probe has to start its pod, resolve the host and open the connections
+        results = run_concurrently([(node_pool.name, lambda node_pool_info=node_pool.get_info(): probe(node_pool_info)) for node_pool in node_pools],
+                                   max_workers=MAX_CONCURRENT_PROBES, timeout=start_timeout + 30 + attempts * 6)
+
+        fmt = MyRunnable._fmt
+        rows = []
+        for result in results:
+            if result.is_success():
+                r = result.value
+                connect = r['connectMs']
+                rows.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s/%s (%.0f%%)</td></tr>'
+                            % (r['nodePool'], r['node'], fmt(r['dnsMs']), fmt(connect['min']), fmt(connect['p50']), fmt(connect['p90']),
+                               fmt(connect['p99']), fmt(connect['max']), r['failures'], r['attempts'], 100 * r['failureRate']))
+            else:
+                rows.append('<tr><td>%s</td><td colspan="8"><div class="alert alert-error">%s</div></td></tr>' % (result.key, str(result.error)))
+        result = '<h5>Latency to %s:%s from each node pool (times in ms)</h5>' % (host, port)
+        result = result + '<table class="table table-striped"><tr><th>Node pool</th><th>Node</th><th>DNS</th><th>Connect min</th><th>p50</th><th>p90</th><th>p99</th><th>max</th><th>Failures</th></tr>%s</table>' % ''.join(rows)
+        return '<div>%s</div>' % result
+
+    def _run_throughput(self, cluster, cluster_def, kube_config_path, host):
+        node_pools = self._get_node_pools(cluster, cluster_def, host)
+        payload_mb = self.config.get('payloadSize', 100)
+        start_timeout = self.config.get('podStartTimeout', 60)
+
+        with ThroughputReceiver(port=self.config.get('receiverPort', 0) or 0) as receiver:
+            def probe(node_pool_info):
+                return benchmark_node_pool_throughput(kube_config_path, node_pool_info, host, receiver, payload_mb, start_timeout)
+            # pods start in parallel, but the transfers are done one at a time
+            results = run_concurrently([(node_pool.name, lambda node_pool_info=node_pool.get_info(): probe(node_pool_info)) for node_pool in node_pools],
+                                       max_workers=MAX_CONCURRENT_PROBES, timeout=start_timeout + 60 + len(node_pools) * (30 + payload_mb))
+
+        fmt = MyRunnable._fmt
+        rows = []
+        for result in results:
+            if result.is_success():
+                r = result.value
+                received = '%.1f MB' % (r['bytes'] / (1024.0 * 1024.0))
+                if not r['complete']:
+                    received = received + ' (incomplete)'
+                rows.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>'
+                            % (r['nodePool'], r['node'], fmt(r['connectMs']), received, fmt(r['mbPerSecond']), fmt(r['podSeconds'])))
+            else:
+                rows.append('<tr><td>%s</td><td colspan="5"><div class="alert alert-error">%s</div></td></tr>' % (result.key, str(result.error)))
+        result = '<h5>Throughput to %s:%s from each node pool (%s MB each)</h5>' % (host, receiver.port, payload_mb)
+        result = result + '<table class="table table-striped"><tr><th>Node pool</th><th>Node</th><th>Connect (ms)</th><th>Received</th><th>MB/s</th><th>Total (s)</th></tr>%s</table>' % ''.join(rows)
+        return '<div>%s</div>' % result
@@ -0,0 +1,80 @@
+"""
+Time merge_or_write_config() on a synthetic kube config: N existing clusters/contexts/users (with 1.5kB of CA
+data each, like GKE ones), merging M of them again plus M new ones. Prints the median of 5 runs and the bytes
+logged per merge. With --baseline, the same merge is done with another version of dku_kube/kubeconfig.py,
+and both results are checked to be identical, e.g. to compare with the version before the index and lock:
+
+    git show 939c54d^:python-lib/dku_kube/kubeconfig.py > /tmp/old_kubeconfig.py
+    python tests/python/benchmarks/bench_kubeconfig_merge.py 2000 200 --baseline /tmp/old_kubeconfig.py
+"""
+import os, sys, time, copy, base64, logging, argparse, tempfile, importlib.util
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'python-lib'))
+from dku_kube import kubeconfig
+
+RUNS = 5
+
+
+def make_config(n, prefix):
+    config = {"apiVersion": "v1", "kind": "Config", "current-context": "%s0" % prefix, "preferences": {},
+              "clusters": [], "contexts": [], "users": []}
+    for i in range(0, n):
+        name = "%s%d" % (prefix, i)
+        config["clusters"].append({"name": name, "cluster": {"server": "https://10.0.%d.%d" % (i // 256, i % 256),
+                                                             "certificate-authority-data": base64.b64encode(os.urandom(1500)).decode()}})
+        config["contexts"].append({"name": name, "context": {"cluster": name, "user": name}})
+        config["users"].append({"name": name, "user": {"exec": {"command": "gke-gcloud-auth-plugin", "provideClusterInfo": True,
+                                                                "apiVersion": "client.authentication.k8s.io/v1beta1"}}})
+    return config
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("baseline_kubeconfig", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench(label, module, existing, incoming, work_dir, log_path):
+    kube_config_path = os.path.join(work_dir, "%s.yaml" % label)
+    durations = []
+    for run in range(0, RUNS):
+        with open(kube_config_path, "w") as f:
+            yaml.safe_dump(existing, f)
+        log_size = os.path.getsize(log_path)
+        start = time.time()
+        module.merge_or_write_config(copy.deepcopy(incoming), kube_config_path)
+        durations.append(time.time() - start)
+    logged = os.path.getsize(log_path) - log_size
+    print("%s: median %.3fs, %d bytes logged per merge" % (label, sorted(durations)[RUNS // 2], logged))
+    with open(kube_config_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("existing", type=int, help="number of entries in the kube config")
+    parser.add_argument("merged", type=int, help="number of existing entries merged again, and of new entries")
+    parser.add_argument("--baseline", help="another kubeconfig.py to compare with")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    log_path = os.path.join(work_dir, "log.txt")
+    logging.basicConfig(level=logging.INFO, filename=log_path)
+    print("libyaml: %s" % yaml.__with_libyaml__)
+
+    existing = make_config(args.existing, "ctx")
+    incoming = make_config(args.merged, "ctx")
+    new_entries = make_config(args.merged, "new")
+    for k in ["clusters", "contexts", "users"]:
+        incoming[k] += new_entries[k]
+
+    result = bench("current", kubeconfig, existing, incoming, work_dir, log_path)
+    if args.baseline is not None:
+        baseline_result = bench("baseline", load_module(args.baseline), existing, incoming, work_dir, log_path)
+        print("same result: %s" % (result == baseline_result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cost of the creation settings valve: parsing + merging it like before (json.loads + _merge_objects) versus
+compiling it once with compile_settings_valve() and applying the compiled patch. Also checks, on random
+(settings, valve) pairs, that the patch gives the same result as _merge_objects and never modifies its input.
+
+    python tests/python/benchmarks/bench_settings_valve.py
+"""
+import os, sys, json, copy, random, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'python-lib'))
+from dku_utils.access import _merge_objects
+from dku_utils.settings_valve import compile_settings_valve
+
+RANDOM_PAIRS = 20000
+
+
+def random_value(depth):
+    r = random.random()
+    if depth > 3 or r < 0.3:
+        return random.choice([1, "s", None, True, 2.5])
+    if r < 0.5:
+        return [random_value(depth + 1) for i in range(0, random.randint(0, 3))]
+    return {random.choice("abcde"): random_value(depth + 1) for i in range(0, random.randint(0, 4))}
+
+
+def check_same_as_merge_objects():
+    random.seed(1)
+    mismatches = 0
+    for i in range(0, RANDOM_PAIRS):
+        settings = {k: random_value(0) for k in random.sample("abcde", 3)}
+        valve = {k: random_value(0) for k in random.sample("abcde", 2)}
+        try:
+            expected = _merge_objects(settings, valve)
+        except Exception as e:
+            expected = ("error", type(e))
+        original = copy.deepcopy(settings)
+        try:
+            result = compile_settings_valve(json.dumps(valve)).apply(settings)
+        except Exception as e:
+            result = ("error", type(e))
+        if result != expected or settings != original:
+            mismatches += 1
+    print("%s random pairs, %s differences from _merge_objects" % (RANDOM_PAIRS, mismatches))
+
+
+def per_call(f, number):
+    return timeit.timeit(f, number=number) / number * 1e6
+
+
+def bench_cluster_body():
+    # a cluster creation body with 20 node pools, and a valve touching 4 of its keys
+    body = {"name": "c", "network": "n", "ipAllocationPolicy": {"useIpAliases": True},
+            "resourceLabels": {"k%d" % j: "v" for j in range(0, 20)},
+            "addonsConfig": {"httpLoadBalancing": {"disabled": False}},
+            "nodePools": [{"name": "p%d" % i, "initialNodeCount": 3, "autoscaling": {"enabled": True},
+                           "config": {"machineType": "e2", "taints": [], "oauthScopes": ["s"] * 5,
+                                      "labels": {"l%d" % j: "v" for j in range(0, 10)},
+                                      "resourceLabels": {"k%d" % j: "v" for j in range(0, 10)}}} for i in range(0, 20)]}
+    valve = json.dumps({"resourceLabels": {"team": "x"},
+                        "addonsConfig": {"gcpFilestoreCsiDriverConfig": {"enabled": True}},
+                        "nodePools": [{"name": "extra", "config": {"machineType": "n2"}}],
+                        "maintenancePolicy": {"window": {"dailyMaintenanceWindow": {"startTime": "03:00"}}}})
+    patch = compile_settings_valve(valve)
+    assert patch.apply(body) == _merge_objects(body, json.loads(valve))
+    number = 20000
+    print("20-pool cluster body, 4-key valve: json.loads+_merge_objects %.1fus, compile %.1fus, apply %.1fus" % (
+        per_call(lambda: _merge_objects(body, json.loads(valve)), number),
+        per_call(lambda: compile_settings_valve(valve), number),
+        per_call(lambda: patch.apply(body), number)))
+
+
+def bench_large_settings():
+    settings = {"k%d" % i: {"a": [1, 2, 3], "b": {"c": i}} for i in range(0, 500)}
+    valve = json.dumps({"k1": {"b": {"d": 1}}})
+    patch = compile_settings_valve(valve)
+    number = 2000
+    print("500-key settings, 1-key valve: json.loads+_merge_objects %.1fus, apply %.1fus" % (
+        per_call(lambda: _merge_objects(settings, json.loads(valve)), number),
+        per_call(lambda: patch.apply(settings), number)))
+
+
+if __name__ == "__main__":
+    check_same_as_merge_objects()
+    bench_cluster_body()
+    bench_large_settings()
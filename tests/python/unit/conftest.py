@@ -0,0 +1,76 @@
+import os, sys, json, threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'python-lib'))
+
+
+class StubRequest(object):
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class StubServer(object):
+    """
+    Local HTTP server recording the requests it gets, and answering with what respond(request) returns:
+    (status, body) where body is a JSON-able object, or a list of lines to stream before closing the connection
+    """
+    def __init__(self):
+        self.requests = []
+        self.respond = lambda request: (404, {})
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8') if length > 0 else None
+                request = StubRequest(self.command, url.path, parse_qs(url.query), dict(self.headers), body)
+                stub.requests.append(request)
+                status, response = stub.respond(request)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if isinstance(response, list):
+                    # streamed, the end of the response is the end of the connection
+                    self.end_headers()
+                    for line in response:
+                        self.wfile.write((json.dumps(line) + '\n').encode('utf-8'))
+                        self.wfile.flush()
+                else:
+                    content = json.dumps(response).encode('utf-8')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.host = '127.0.0.1:%s' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,137 @@
+import os, sys, json
+import pytest
+import yaml
+
+from dku_kube import api_client
+from dku_kube.api_client import KubeApiClient, KubeApiException, FIELD_MANAGER
+
+EXEC_PLUGIN = """
+import os, sys, json
+counter_path = sys.argv[1]
+count = int(open(counter_path).read()) + 1 if os.path.exists(counter_path) else 1
+with open(counter_path, "w") as f:
+    f.write(str(count))
+assert json.loads(os.environ["KUBERNETES_EXEC_INFO"])["kind"] == "ExecCredential"
+print(json.dumps({"kind": "ExecCredential", "status": {"token": "token-%s" % count, "expirationTimestamp": "2100-01-01T00:00:00Z"}}))
+"""
+
+
+def _write_kube_config(tmp_path, server, user):
+    kube_config = {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "current-context": "test",
+        "contexts": [{"name": "test", "context": {"cluster": "test-cluster", "user": "test-user"}}],
+        "clusters": [{"name": "test-cluster", "cluster": {"server": "http://%s/" % server.host}}],
+        "users": [{"name": "test-user", "user": user}]
+    }
+    kube_config_path = str(tmp_path / "kube_config")
+    with open(kube_config_path, "w") as f:
+        yaml.safe_dump(kube_config, f)
+    return kube_config_path
+
+
+@pytest.fixture
+def client(tmp_path, stub_server):
+    return KubeApiClient(_write_kube_config(tmp_path, stub_server, {"token": "static-token"}))
+
+
+@pytest.fixture
+def exec_plugin(tmp_path):
+    script_path = str(tmp_path / "exec_plugin.py")
+    with open(script_path, "w") as f:
+        f.write(EXEC_PLUGIN)
+    counter_path = str(tmp_path / "exec_count")
+    api_client.EXEC_TOKENS.clear()
+    yield {"command": sys.executable, "args": [script_path, counter_path], "apiVersion": "client.authentication.k8s.io/v1beta1"}, counter_path
+    api_client.EXEC_TOKENS.clear()
+
+
+def test_get(client, stub_server):
+    stub_server.respond = lambda request: (200, {"kind": "DaemonSet", "metadata": {"name": "nvidia-driver-installer"}})
+    daemonset = client.get("DaemonSet", "nvidia-driver-installer", namespace="kube-system")
+    assert daemonset["metadata"]["name"] == "nvidia-driver-installer"
+    request = stub_server.requests[0]
+    assert request.method == "GET"
+    assert request.path == "/apis/apps/v1/namespaces/kube-system/daemonsets/nvidia-driver-installer"
+    assert request.headers["Authorization"] == "Bearer static-token"
+
+
+def test_get_missing(client, stub_server):
+    stub_server.respond = lambda request: (404, {"kind": "Status", "code": 404})
+    assert client.get("Pod", "nope", namespace="default") is None
+
+
+def test_list(client, stub_server):
+    stub_server.respond = lambda request: (200, {"kind": "NodeList", "items": [{"metadata": {"name": "n1"}}]})
+    nodes = client.list("Node", label_selector="cloud.google.com/gke-accelerator")
+    assert [node["metadata"]["name"] for node in nodes["items"]] == ["n1"]
+    request = stub_server.requests[0]
+    assert request.path == "/api/v1/nodes"
+    assert request.query == {"labelSelector": ["cloud.google.com/gke-accelerator"]}
+
+
+def test_create(client, stub_server):
+    stub_server.respond = lambda request: (201, request.json())
+    manifest = {"kind": "ClusterRoleBinding", "metadata": {"name": "admin"}, "roleRef": {"name": "cluster-admin"}}
+    assert client.create(manifest) == manifest
+    request = stub_server.requests[0]
+    assert request.method == "POST"
+    assert request.path == "/apis/rbac.authorization.k8s.io/v1/clusterrolebindings"
+    assert request.json() == manifest
+
+
+def test_apply(client, stub_server):
+    stub_server.respond = lambda request: (200, request.json())
+    manifest = {"kind": "DaemonSet", "metadata": {"name": "nvidia-driver-installer", "namespace": "kube-system"}}
+    assert client.apply(manifest) == manifest
+    request = stub_server.requests[0]
+    assert request.method == "PATCH"
+    assert request.path == "/apis/apps/v1/namespaces/kube-system/daemonsets/nvidia-driver-installer"
+    assert request.query == {"fieldManager": [FIELD_MANAGER], "force": ["true"]}
+    assert request.headers["Content-Type"] == "application/apply-patch+yaml"
+
+
+def test_delete(client, stub_server):
+    stub_server.respond = lambda request: (200, {"kind": "Status"})
+    assert client.delete("Pod", "p1", namespace="default", grace_period_seconds=0)
+    request = stub_server.requests[0]
+    assert request.method == "DELETE"
+    assert request.path == "/api/v1/namespaces/default/pods/p1"
+    assert request.query == {"gracePeriodSeconds": ["0"]}
+
+    stub_server.respond = lambda request: (404, {"kind": "Status"})
+    assert not client.delete("Pod", "p1", namespace="default")
+
+
+def test_error(client, stub_server):
+    stub_server.respond = lambda request: (403, {"kind": "Status", "reason": "Forbidden"})
+    with pytest.raises(KubeApiException) as e:
+        client.list("Pod", namespace="default")
+    assert e.value.status_code == 403
+
+
+def test_watch(client, stub_server):
+    events = [{"type": "ADDED", "object": {"metadata": {"name": "p1"}}},
+              {"type": "MODIFIED", "object": {"metadata": {"name": "p1"}, "status": {"phase": "Running"}}},
+              {"type": "DELETED", "object": {"metadata": {"name": "p1"}}}]
+    stub_server.respond = lambda request: (200, events)
+    assert list(client.watch("Pod", namespace="default", field_selector="metadata.name=p1", timeout=5)) == events
+    request = stub_server.requests[0]
+    assert request.path == "/api/v1/namespaces/default/pods"
+    assert request.query == {"watch": ["true"], "fieldSelector": ["metadata.name=p1"], "timeoutSeconds": ["5"]}
+
+
+def test_exec_token_renewed_on_401(tmp_path, stub_server, exec_plugin):
+    exec_config, counter_path = exec_plugin
+    client = KubeApiClient(_write_kube_config(tmp_path, stub_server, {"exec": exec_config}))
+    # the first token is rejected, as if it had been revoked
+    stub_server.respond = lambda request: (200, {"items": []}) if request.headers.get("Authorization") == "Bearer token-2" else (401, {"kind": "Status"})
+    assert client.list("Node") == {"items": []}
+    assert [request.headers["Authorization"] for request in stub_server.requests] == ["Bearer token-1", "Bearer token-2"]
+
+    # the renewed token is kept for the next calls
+    client.list("Node")
+    assert stub_server.requests[-1].headers["Authorization"] == "Bearer token-2"
+    with open(counter_path, "r") as f:
+        assert f.read() == "2"
@@ -0,0 +1,80 @@
+import os, time, threading, multiprocessing
+import pytest
+import yaml
+
+from dku_utils import files
+from dku_kube.kubeconfig import merge_or_write_config
+
+
+def _config(*names):
+    return {"apiVersion": "v1", "kind": "Config",
+            "clusters": [{"name": name, "cluster": {"server": "https://%s" % name}} for name in names],
+            "contexts": [{"name": name, "context": {"cluster": name, "user": name}} for name in names],
+            "users": [{"name": name, "user": {"token": name}} for name in names]}
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def test_merge(tmp_path):
+    kube_config_path = str(tmp_path / "config")
+    merge_or_write_config(_config("a", "b"), kube_config_path)
+    changed = _config("b", "c")
+    changed["users"][0]["user"]["token"] = "new"
+    merge_or_write_config(changed, kube_config_path)
+    merged = _read(kube_config_path)
+    for k in ["clusters", "contexts", "users"]:
+        assert [element["name"] for element in merged[k]] == ["a", "b", "c"]
+    assert merged["users"][1]["user"]["token"] == "new"
+    # the lock file is gone, so that kubectl can take it
+    assert os.listdir(str(tmp_path)) == ["config"]
+
+
+def _merge_many(kube_config_path, i):
+    for j in range(0, 5):
+        merge_or_write_config(_config("p%s-%s" % (i, j)), kube_config_path)
+
+
+def test_concurrent_merges(tmp_path):
+    kube_config_path = str(tmp_path / "config")
+    processes = [multiprocessing.Process(target=_merge_many, args=(kube_config_path, i)) for i in range(0, 4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert len(_read(kube_config_path)["contexts"]) == 20
+    assert not os.path.exists(kube_config_path + ".lock")
+
+
+def test_waits_for_lock_held_by_kubectl(tmp_path):
+    kube_config_path = str(tmp_path / "config")
+    lock_path = kube_config_path + ".lock"
+    # kubectl holds <kube config>.lock while it rewrites the file
+    open(lock_path, "w").close()
+    releaser = threading.Timer(0.3, lambda: os.remove(lock_path))
+    releaser.start()
+    start = time.time()
+    merge_or_write_config(_config("a"), kube_config_path)
+    assert time.time() - start >= 0.3
+    assert [element["name"] for element in _read(kube_config_path)["contexts"]] == ["a"]
+
+
+def test_stale_lock(tmp_path):
+    lock_path = str(tmp_path / "config.lock")
+    open(lock_path, "w").close()
+    os.utime(lock_path, (time.time() - files.STALE_LOCK_FILE_AGE - 1,) * 2)
+    with files.lock_file(lock_path):
+        assert os.path.exists(lock_path)
+    assert not os.path.exists(lock_path)
+
+
+def test_lock_timeout(tmp_path):
+    lock_path = str(tmp_path / "config.lock")
+    open(lock_path, "w").close()
+    with pytest.raises(Exception) as e:
+        with files.lock_file(lock_path, timeout=0.1):
+            pass
+    assert "Timed out" in str(e.value)
+    assert os.path.exists(lock_path)
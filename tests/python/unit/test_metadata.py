@@ -0,0 +1,67 @@
+import json, time
+import pytest
+
+from dku_google import metadata, gcloud
+from dku_google.metadata import MetadataClient, METADATA_HOST_ENV
+
+INSTANCE_METADATA = {
+    "project": {"projectId": "my-project", "numericProjectId": 1234},
+    "instance": {
+        "name": "dss-host",
+        "zone": "projects/1234/zones/europe-west1-b",
+        "serviceAccounts": {"default": {"email": "dss@my-project.iam.gserviceaccount.com"}}
+    }
+}
+
+
+@pytest.fixture
+def metadata_server(stub_server, monkeypatch):
+    monkeypatch.setenv(METADATA_HOST_ENV, stub_server.host)
+    monkeypatch.setattr(metadata, "METADATA_CLIENT", None)
+    stub_server.respond = lambda request: (200, INSTANCE_METADATA)
+    return stub_server
+
+
+def test_single_recursive_fetch(metadata_server):
+    client = MetadataClient()
+    assert client.get_instance_info() == {"project": "my-project", "zone": "europe-west1-b", "region": "europe-west1", "vm_name": "dss-host"}
+    assert len(metadata_server.requests) == 1
+    request = metadata_server.requests[0]
+    assert request.path == "/computeMetadata/v1/"
+    assert request.query == {"recursive": ["true"]}
+    assert request.headers["Metadata-Flavor"] == "Google"
+
+
+def test_memoized(metadata_server):
+    client = metadata.get_metadata_client()
+    assert metadata.get_metadata_client() is client
+    client.get_instance_info()
+    assert client.get_metadata() == INSTANCE_METADATA
+    metadata.get_metadata_client().get_instance_info()
+    assert len(metadata_server.requests) == 1
+
+
+def _respond_slowly(request):
+    time.sleep(0.5)
+    return 200, INSTANCE_METADATA
+
+
+def test_timeout(metadata_server):
+    metadata_server.respond = _respond_slowly
+    client = MetadataClient(timeout=(1, 0.1))
+    start = time.time()
+    with pytest.raises(Exception) as e:
+        client.get_metadata()
+    assert time.time() - start < 0.5
+    assert "Unable to reach the metadata server" in str(e.value)
+
+
+def test_timeout_falls_back_to_gcloud(metadata_server, monkeypatch):
+    metadata_server.respond = _respond_slowly
+    monkeypatch.setattr(metadata, "METADATA_CLIENT", MetadataClient(timeout=(1, 0.1)))
+    monkeypatch.setattr(gcloud, "HOST_SERVICE_ACCOUNT", None)
+    monkeypatch.setattr(gcloud, "_get_gcloud_configured_account", lambda: None)
+    auth_list = [{"account": "other@my-project.iam.gserviceaccount.com", "status": ""},
+                 {"account": "gcloud@my-project.iam.gserviceaccount.com", "status": "ACTIVE"}]
+    monkeypatch.setattr(gcloud, "_run_cmd", lambda cmd: json.dumps(auth_list))
+    assert gcloud.get_instance_service_account() == "gcloud@my-project.iam.gserviceaccount.com"
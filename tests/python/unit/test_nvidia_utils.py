@@ -0,0 +1,60 @@
+import pytest
+
+from dku_kube import nvidia_utils
+from dku_kube.nvidia_utils import get_expected_gpu_nodes, wait_for_gpu_nodes_ready
+
+
+def _node(name, node_pool, gpus=0):
+    return {"metadata": {"name": name, "labels": {"cloud.google.com/gke-nodepool": node_pool}},
+            "status": {"allocatable": {"nvidia.com/gpu": str(gpus)}}}
+
+
+class FakeClient(object):
+    """
+    Answers each list() with the next list of nodes, then keeps answering with the last one
+    """
+    def __init__(self, polls):
+        self.polls = polls
+        self.calls = 0
+
+    def list(self, kind, label_selector=None):
+        nodes = self.polls[min(self.calls, len(self.polls) - 1)]
+        self.calls += 1
+        return {"items": nodes}
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    monkeypatch.setattr(nvidia_utils, "GPU_NODES_POLL_INTERVAL", 0)
+    def use(polls):
+        client = FakeClient(polls)
+        monkeypatch.setattr(nvidia_utils, "get_kube_api_client", lambda kube_config_path: client)
+        return client
+    return use
+
+
+def test_expected_gpu_nodes():
+    node_pools = [{"name": "gpu", "initialNodeCount": 2, "locations": ["europe-west1-b", "europe-west1-c"], "config": {"accelerators": [{"acceleratorCount": "1"}]}},
+                  {"name": "cpu", "initialNodeCount": 3, "locations": ["europe-west1-b"], "config": {}}]
+    assert get_expected_gpu_nodes(node_pools) == {"gpu": 4}
+
+
+def test_waits_for_nodes_to_register(fake_client):
+    client = fake_client([[], [], [_node("n1", "gpu")], [_node("n1", "gpu", 1), _node("n2", "gpu", 1)]])
+    report = wait_for_gpu_nodes_ready(expected_nodes={"gpu": 2}, timeout=5)
+    assert client.calls == 4
+    assert sorted(name for name in report if report[name]["ready"]) == ["n1", "n2"]
+
+
+def test_node_gone_before_ready(fake_client):
+    # n1 is preempted before its drivers are installed, and replaced by n2
+    fake_client([[_node("n1", "gpu")], [_node("n2", "gpu")], [_node("n2", "gpu", 1)]])
+    report = wait_for_gpu_nodes_ready(expected_nodes={"gpu": 1}, timeout=5)
+    assert report["n1"]["gone"] and not report["n1"]["ready"]
+    assert report["n2"]["ready"] and not report["n2"]["gone"]
+
+
+def test_timeout(fake_client):
+    fake_client([[_node("n1", "gpu")]])
+    report = wait_for_gpu_nodes_ready(expected_nodes={"gpu": 2}, timeout=0.1)
+    assert report == {"n1": {"nodePool": "gpu", "ready": False, "gone": False, "driverLatencySeconds": None}}
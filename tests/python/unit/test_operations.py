@@ -0,0 +1,85 @@
+import pytest
+
+from dku_google import operations
+from dku_google.operations import Operation, OperationGroup, OperationWaitException
+
+
+class FakeRequest(object):
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeOperationsApi(object):
+    """
+    Operations of a location, each one DONE after a given number of polls
+    """
+    def __init__(self, polls_until_done):
+        self.polls_until_done = polls_until_done
+        self.list_calls = []
+        self.get_calls = []
+
+    def _operation(self, operation_id):
+        self.polls_until_done[operation_id] -= 1
+        status = 'DONE' if self.polls_until_done[operation_id] <= 0 else 'RUNNING'
+        return {'name': operation_id, 'status': status, 'operationType': 'SET_NODE_POOL_SIZE', 'progress': {'status': status}}
+
+    def list(self, **kwargs):
+        self.list_calls.append(kwargs)
+        return FakeRequest({'operations': [self._operation(operation_id) for operation_id in self.polls_until_done if operation_id != 'unlisted']})
+
+    def get(self, operationId=None, **kwargs):
+        self.get_calls.append(operationId)
+        return FakeRequest(self._operation(operationId))
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(operations, "POLLING_INTERVALS", {})
+    monkeypatch.setattr(operations, "DEFAULT_POLLING_INTERVALS", (0.001, 0.001))
+
+
+def _operation(api, operation_id, location_data):
+    return Operation({'name': operation_id, 'status': 'RUNNING', 'operationType': 'SET_NODE_POOL_SIZE'}, api, location_data)
+
+
+def test_one_list_per_location_and_poll():
+    api = FakeOperationsApi({'op-1': 2, 'op-2': 4})
+    location = {'projectId': 'p', 'region': 'europe-west1'}
+    done = []
+    group = OperationGroup()
+    group.add(_operation(api, 'op-1', location), callback=done.append)
+    group.add(_operation(api, 'op-2', location), callback=done.append)
+    completed = [operation.operation_id for operation in group.as_completed(timeout=5)]
+    assert completed == ['op-1', 'op-2']
+    assert [operation.operation_id for operation in done] == ['op-1', 'op-2']
+    assert len(api.list_calls) == 4
+    assert api.list_calls[0] == {'parent': 'projects/p/locations/europe-west1'}
+    assert api.get_calls == []
+
+
+def test_unlisted_operation_is_fetched():
+    api = FakeOperationsApi({'op-1': 1, 'unlisted': 1})
+    location = {'projectId': 'p', 'zone': 'europe-west1-b'}
+    group = OperationGroup([_operation(api, 'op-1', location), _operation(api, 'unlisted', location)])
+    assert len(group.wait_done(timeout=5)) == 2
+    assert api.list_calls == [{'projectId': 'p', 'zone': 'europe-west1-b'}]
+    assert api.get_calls == ['unlisted']
+
+
+def test_progress():
+    api = FakeOperationsApi({'op-1': 1, 'op-2': 3})
+    location = {'projectId': 'p', 'zone': 'europe-west1-b'}
+    fractions = []
+    group = OperationGroup([_operation(api, 'op-1', location), _operation(api, 'op-2', location)])
+    group.wait_done(timeout=5, progress_callback=lambda progress: fractions.append(progress.get_fraction()))
+    assert fractions == [0.0, 0.5, 0.5, 1.0]
+
+
+def test_timeout():
+    api = FakeOperationsApi({'op-1': 1000000})
+    group = OperationGroup([_operation(api, 'op-1', {'projectId': 'p', 'zone': 'europe-west1-b'})])
+    with pytest.raises(OperationWaitException):
+        group.wait_done(timeout=0.05)